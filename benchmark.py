@@ -0,0 +1,312 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Benchmarks for the hot paths of finncards on synthetic decks
+
+Each deck is generated into a temporary directory, so the data files in the
+working directory are never touched. Results are written as JSON, and two
+result files can be compared to spot regressions between commits:
+
+    python benchmark.py --sizes 1000,10000 --output before.json
+    python benchmark.py compare before.json after.json
+"""
+
+import argparse
+import contextlib
+import datetime
+import io
+import json
+import numpy as np
+import os
+import pandas as pd
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+
+import finncards
+
+# Share of a deck's rows in each category
+DECK_SHARES = {
+        'invariant': 0.3,
+        'nominal': 0.35,
+        'verb': 0.15,
+        'phrase': 0.2
+        }
+
+# Syllables synthetic words are made of
+SYLLABLES = ['ka', 'ta', 'la', 'si', 'mi', 'ko', 'pu', 'va', 'nä', 'hy',
+             'ro', 'te', 'ne', 'jo', 'ki', 'lu', 'sä', 'tö', 'an', 'ul']
+
+# Endings for the synthetic forms of nominals and verbs
+NOMINAL_ENDINGS = ['t', 'a', 'ja', 'n', 'jen', 'an', 'ihin', 'ssa', 'issa',
+                   'sta', 'ista', 'lla', 'illa', 'lta', 'ilta', 'lle', 'ille',
+                   'na', 'ina', 'ksi', 'iksi', 'tta', 'itta']
+VERB_ENDINGS = ['n', 'n', 'mme', 't', 'tte', 'vat', 'i', 'imme', 'it',
+                'itte', 'ivat', 'isi', 'kaa', 'koon', 'nut', 'neet', 'ttu',
+                'ttiin', 'nee', 'maan', 'massa', 'malla', 'minen', 'va']
+
+# Filler making fixture pages about the size of a real Wiktionary page
+FILLER = ("<div class=\"mw-parser-output\"><p>Lorem ipsum dolor sit amet, "
+          "<a href=\"/wiki/x\" title=\"x\">consectetur</a> adipiscing "
+          "elit.</p><ul><li>sed do</li><li>eiusmod tempor</li></ul>"
+          "</div>\n") * 800
+
+def synthetic_words(count, rng, length=3):
+    """Unique Finnish-looking words"""
+    words = set()
+    while len(words) < count:
+        picks = rng.integers(0, len(SYLLABLES),
+                             size=(count - len(words), length))
+        lengths = rng.integers(2, length + 1, size=len(picks))
+        words.update("".join(SYLLABLES[i] for i in row[:n]) for
+                     row, n in zip(picks, lengths))
+        length += 1
+    return sorted(words)[:count]
+
+def synthetic_stats(count, rng, now):
+    """Review stats spread like a deck in daily use
+
+    Last reviews fall off over the past year, intervals are log-normal
+    between the minimum and maximum interval, and about one card in eight
+    was last answered wrong"""
+    age = np.minimum(rng.exponential(60, count), 365)
+    last_reviewed = now - pd.to_timedelta(age, unit='D')
+    interval_days = np.clip(rng.lognormal(2, 1.2, count),
+                            finncards.MINIMUM_INTERVAL.days,
+                            finncards.MAXIMUM_INTERVAL.days)
+    interval = pd.to_timedelta(interval_days, unit='D')
+    correct = rng.random(count) > 0.125
+    times_correct = rng.poisson(interval_days ** 0.5 + 1)
+    times_incorrect = rng.poisson(0.4, count) + ~correct
+    return pd.DataFrame({
+            'Last reviewed': last_reviewed,
+            'Next review': last_reviewed + interval,
+            'Interval': interval,
+            'Correct?': correct,
+            'Times correct': times_correct,
+            'Times incorrect': times_incorrect})
+
+def synthetic_deck(size, seed=0, now=None):
+    """A deck of about size rows, as a dataframe per category"""
+    if now is None:
+        now = pd.Timestamp(datetime.datetime.now())
+    rng = np.random.default_rng(seed)
+    counts = {cat: max(1, int(size * share)) for
+              cat, share in DECK_SHARES.items()}
+    words = iter(synthetic_words(sum(counts.values()) - counts['phrase'],
+                                 rng))
+    english = pd.Series(synthetic_words(size, rng)).str.upper()
+    deck = {}
+    for cat, count in counts.items():
+        if cat == 'phrase':
+            picks = rng.integers(0, len(english), size=(count, 2))
+            content = pd.DataFrame({
+                    'Finnish': [" ".join(english[row].str.lower()) for
+                                row in picks],
+                    'English': [" ".join(english[row[::-1]]).lower() for
+                                row in picks]})
+        else:
+            keys = pd.Series([next(words) for _ in range(count)])
+            glosses = english.sample(count, random_state=seed).values
+            content = pd.DataFrame({'English': glosses}, index=keys)
+            if cat == 'invariant':
+                content['Pre / Post'] = ""
+                content['Rection'] = ""
+            elif cat == 'verb':
+                content.columns = ['English present']
+                content['English simple past'] = glosses + "ED"
+                content['English past participle'] = glosses + "ED"
+                content['English present participle'] = glosses + "ING"
+            if cat in finncards.FORM_COLUMNS:
+                endings = (NOMINAL_ENDINGS if cat == 'nominal' else
+                           VERB_ENDINGS)
+                forms = {form: keys.str[:-1] + endings[i % len(endings)] for
+                         i, form in enumerate(finncards.FORM_COLUMNS[cat])}
+                content = content.join(pd.DataFrame(forms).set_index(keys))
+            content.index.name = finncards.INDEX_COLUMNS[cat]
+        stats = synthetic_stats(count, rng, now).set_index(content.index)
+        deck[cat] = content.join(stats)
+    return deck
+
+def write_deck(deck):
+    """Write a deck's data files in the working directory"""
+    for cat, words_df in deck.items():
+        finncards.write_data(words_df, cat)
+
+def fixture_page(cat, word, forms):
+    """A Wiktionary-like page holding a word's forms"""
+    if cat == 'nominal':
+        body = "".join(
+                "<td><span class=\"{}\"><a href=\"/wiki/{}\" title=\"{} "
+                "(page does not exist)\">{}</a></span></td>".format(
+                        finncards.NOMINAL_FORMS[form], value, value, value)
+                for form, value in zip(finncards.NOMINAL_FORMS, forms))
+    else:
+        body = ("<div class=\"NavFrame\"><div class=\"NavHead\">Conjugation "
+                "of {} (Kotus type 53/muistaa)</div><div class=\"NavContent"
+                "\"><table><tr>{}</tr></table></div></div>".format(
+                        word, "".join(
+                                "<td><span lang=\"fi\">{}</span></td>".format(
+                                        value) for value in forms)))
+    return ("<html><head><title>{} - Wiktionary</title></head><body>{}"
+            "<table>{}</table>{}</body></html>".format(word, FILLER, body,
+                                                      FILLER))
+
+def time_it(function, repeat, setup=None):
+    """Seconds taken by each of repeat calls, running setup untimed before
+    each one"""
+    times = []
+    for _ in range(repeat):
+        if setup is not None:
+            setup()
+        start = time.perf_counter()
+        function()
+        times.append(time.perf_counter() - start)
+    return times
+
+def summarize(name, size, times):
+    """A benchmark result as a JSON-ready dict"""
+    return {'benchmark': name,
+            'size': size,
+            'repeat': len(times),
+            'min': min(times),
+            'median': float(np.median(times)),
+            'mean': float(np.mean(times)),
+            'max': max(times)}
+
+def fresh_deck():
+    """Drop the session's deck so the next load reads the data files"""
+    finncards.current_deck = None
+
+def bench_deck(size, repeat, seed=0):
+    """Time the hot paths on one synthetic deck"""
+    deck = synthetic_deck(size, seed)
+    loads = {'invariant': finncards.load_invariants,
+             'nominal': finncards.load_nominals,
+             'verb': finncards.load_verbs,
+             'phrase': finncards.load_phrases}
+    results = []
+    def run(name, function, setup=None, times=repeat):
+        results.append(summarize(name, size,
+                                 time_it(function, times, setup)))
+    write_deck(deck)
+    for cat, load in loads.items():
+        run("load_{}s".format(cat), load, setup=fresh_deck)
+    fresh_deck()
+    run("generate_words_list (cold)", finncards.generate_words_list,
+        setup=fresh_deck)
+    run("generate_words_list (warm)", finncards.generate_words_list)
+    invariants = finncards.load_stats('invariant')
+    keys = iter(np.random.default_rng(seed).permutation(
+            invariants.index.values))
+    def answer(process):
+        def review():
+            process(next(keys), invariants, 'invariant')
+            finncards.flush_deck()
+        return review
+    run("process_correct + save", answer(finncards.process_correct))
+    run("process_incorrect + save", answer(finncards.process_incorrect))
+    word = deck['nominal'].index[len(deck['nominal']) // 2]
+    english = deck['nominal']['English'].iloc[len(deck['nominal']) // 2]
+    run("in_file (key)", lambda: finncards.in_file(
+            word, category='nominal'), times=repeat * 100)
+    run("in_file (english)", lambda: finncards.in_file(
+            english, category='nominal', english=True), times=repeat * 100)
+    search = deck['phrase']['English'].iloc[0].split(" ")[0]
+    run("edit_phrase search", lambda: finncards.get_deck().search_phrases(
+            search), times=repeat * 10)
+    for cat in ['nominal', 'verb']:
+        word = deck[cat].index[0]
+        page = fixture_page(cat, word, list(
+                deck[cat].loc[word, finncards.FORM_COLUMNS[cat]]))
+        run("extract_forms {}".format(cat), lambda: finncards.extract_forms(
+                page, cat, report=False))
+        run("retrieve_{} parse".format(cat), lambda: finncards.lookup_forms(
+                word, cat, fetch=lambda _: page, cache={}))
+    return results
+
+def git_commit():
+    """The commit being benchmarked, if this is a git checkout"""
+    try:
+        return subprocess.run(
+                ['git', 'rev-parse', '--short', 'HEAD'],
+                cwd=os.path.dirname(os.path.abspath(__file__)),
+                capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def run_benchmarks(sizes=(1000, 10000), repeat=5, output=None, seed=0):
+    """Run the benchmarks on a deck of each size, writing the results to
+    output as JSON"""
+    results = []
+    home = os.getcwd()
+    for size in sizes:
+        with tempfile.TemporaryDirectory() as directory:
+            os.chdir(directory)
+            try:
+                with contextlib.redirect_stdout(io.StringIO()):
+                    results.extend(bench_deck(size, repeat, seed))
+            finally:
+                fresh_deck()
+                os.chdir(home)
+        for result in results:
+            if result['size'] == size:
+                print("{size:>8} {benchmark:<28} {median:.3g}s".format(
+                        **result))
+    report = {'commit': git_commit(),
+              'created': datetime.datetime.now().isoformat(),
+              'python': platform.python_version(),
+              'pandas': pd.__version__,
+              'storage_format': finncards.STORAGE_FORMAT,
+              'results': results}
+    if output is not None:
+        with open(output, 'w') as report_file:
+            json.dump(report, report_file, indent=2)
+        print("Wrote {}".format(output))
+    return report
+
+def compare(before, after, threshold=1.1):
+    """Compare two result files, flagging benchmarks at least threshold
+    times slower"""
+    with open(before) as report_file:
+        old = {(result['benchmark'], result['size']): result['median'] for
+               result in json.load(report_file)['results']}
+    with open(after) as report_file:
+        new = json.load(report_file)['results']
+    slower = []
+    for result in new:
+        key = (result['benchmark'], result['size'])
+        if key not in old:
+            continue
+        ratio = result['median'] / old[key]
+        flag = " slower" if ratio >= threshold else ""
+        print("{:>8} {:<28} {:.2f}x{}".format(key[1], key[0], ratio, flag))
+        if flag:
+            slower.append(key)
+    return slower
+
+def main(argv=None):
+    """Command line entry point"""
+    parser = argparse.ArgumentParser(description=__doc__.strip().split(
+            "\n")[0])
+    parser.add_argument('--sizes', default="1000,10000",
+                        help="comma-separated deck sizes")
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--format', default=finncards.STORAGE_FORMAT,
+                        help="storage format of the synthetic decks")
+    parser.add_argument('--output', default="benchmark.json")
+    if argv is None:
+        argv = sys.argv[1:]
+    if argv and argv[0] == 'compare':
+        return 1 if compare(*argv[1:3]) else 0
+    args = parser.parse_args(argv)
+    finncards.STORAGE_FORMAT = args.format
+    run_benchmarks([int(size) for size in args.sizes.split(",")],
+                   args.repeat, os.path.abspath(args.output), args.seed)
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
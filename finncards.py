@@ -9,14 +9,34 @@ Finnish flashcards application with spaced repetition and retrieval of word
 forms from the internet
 """
 
+import atexit
+import bz2
+import contextlib
+import csv
 import datetime
+import functools
+import gzip
+import hashlib
+import heapq
+import importlib.util
+import json
+import numpy as np
 from numpy import nan
 import os
 import pandas as pd
 import random
-from shutil import copy
-from bs4 import BeautifulSoup
-from requests_html import HTMLSession
+import re
+import signal
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from urllib.parse import parse_qs, urlsplit
+from xml.etree import ElementTree
+# bs4, requests_html, asyncio and multiprocessing are imported where they are
+# used, so quizzing on local data doesn't load the scraping stack
 
 # General settings
 # Multiply the interval for a correct answer by this
@@ -33,6 +53,144 @@ MAX_AFTER_WRONG = pd.to_timedelta('6 days 00:00:00')
 FURTHER_TESTING_RATE = 4
 # Anything in this list always does further testing
 FURTHER_TESTING = ['verbs']
+# Write changes from a background thread during a session instead of only
+# at exit. Not used with USE_JOURNAL, which already saves every answer
+BACKGROUND_WRITES = False
+# Seconds without a change before the background writer writes
+WRITE_DELAY = 2
+# Most answers the background writer can leave unwritten, and so the most
+# a crash can lose. Answering waits while this many are unwritten
+WRITE_WINDOW = 10
+# Move each correct card's next review to the least loaded day near it
+LOAD_BALANCE = False
+# How far a review can be moved, as a share of its interval
+LOAD_BALANCE_FUZZ = 0.1
+# Most days a review can be moved either way
+LOAD_BALANCE_DAYS = 3
+# Most cards never reviewed before in a flashcards session, None for all
+MAX_NEW_CARDS = None
+# Most cards already reviewed before in a flashcards session, None for all
+MAX_DUE_CARDS = None
+# Number of cards shown before a failed card comes back in a session
+REQUEUE_GAP = 3
+# Take turns between the categories in a session instead of mixing them
+INTERLEAVE_CATEGORIES = False
+# Keep nominal and verb forms in memory as long, dictionary-encoded tables
+LONG_FORMS = False
+# Share of a search's trigrams a phrase needs to be a match
+PHRASE_SEARCH_THRESHOLD = 0.5
+# Seconds importing this module may take, about 0.3 when measured
+IMPORT_TIME_BUDGET = 0.5
+# Modules a quiz-only session must not import
+SCRAPING_MODULES = ['bs4', 'requests_html', 'lxml']
+# Where forms are retrieved from
+WIKTIONARY_URL = "https://en.wiktionary.org/wiki/{}"
+# Parser for Wiktionary pages, lxml when it is installed
+HTML_PARSER = ('lxml' if importlib.util.find_spec('lxml') is not None else
+               'html.parser')
+# Cached Wiktionary pages
+CACHE_DIR = 'cache'
+# Fetch a cached page again once it is older than this
+CACHE_REFRESH = pd.to_timedelta('30 days')
+# Evict cached pages older than this
+CACHE_MAX_AGE = pd.to_timedelta('365 days')
+# Evict the oldest cached pages once the cache is bigger than this
+CACHE_MAX_BYTES = 50 * 1024 * 1024
+# Only use cached pages, never the network
+CACHE_OFFLINE = False
+# Version of extract_forms. Raise it when the extraction changes, so forms
+# cached by an older version are extracted again from the cached pages
+EXTRACTOR_VERSION = 1
+# Most page fetches in flight at once during a bulk import
+IMPORT_CONCURRENCY = 8
+# Most page fetches started per second during a bulk import
+IMPORT_RATE = 2
+# Attempts at fetching each page during a bulk import
+IMPORT_ATTEMPTS = 3
+# Seconds to wait before the first retry, doubling after each attempt
+IMPORT_BACKOFF = 1
+# Worker processes for ingesting a Wiktionary dump, None for one per core
+INGEST_PROCESSES = None
+# Append reviews to the journal instead of rewriting the data file each time
+USE_JOURNAL = False
+# Format of the data files: 'csv', 'feather', 'parquet' or 'sqlite'.
+# Loading a whole table from feather or parquet takes about a third of the
+# time csv does. Loading just the stats columns is 15-30 times faster
+STORAGE_FORMAT = 'csv'
+# Keep each category's review stats in a file of their own, apart from the
+# content of its cards, and only load the content when a card is shown
+SPLIT_STATS = False
+# Database used when STORAGE_FORMAT is 'sqlite'
+DATABASE_FILE = 'finncards.db'
+# How dates are stored in the database, sortable as text
+SQL_DATE_FORMAT = '%Y-%m-%d %H:%M:%S.%f'
+# Time the phases of a session and write a summary at exit. Setting the
+# FINNCARDS_TIMING environment variable turns this on too
+TIMING = bool(os.environ.get('FINNCARDS_TIMING'))
+# Where the timing summary is written
+TIMING_FILE = 'timings.json'
+# Address the review service listens on
+SERVICE_HOST = '127.0.0.1'
+SERVICE_PORT = 8642
+# Each learner's stats for the review service
+LEARNERS_DIR = 'learners'
+# Seconds between saves of the learners' stats by the review service
+LEARNER_SAVE_INTERVAL = 5
+
+# Data file for each category, without the extension
+DATA_FILES = {
+        'invariant': 'invariants',
+        'nominal': 'nominals',
+        'verb': 'verbs',
+        'phrase': 'phrases'
+        }
+
+# Index column of each category's data file
+INDEX_COLUMNS = {
+        'invariant': 'Finnish',
+        'nominal': 'Nominative singular',
+        'verb': 'Infinitive',
+        'phrase': None
+        }
+
+# Categories of single words, as opposed to phrases
+WORD_CATEGORIES = ['invariant', 'nominal', 'verb']
+
+# English column of each category
+ENGLISH_COLUMNS = {
+        'invariant': 'English',
+        'nominal': 'English',
+        'verb': 'English present',
+        'phrase': 'English'
+        }
+
+# Reviews not yet folded back into the data files
+JOURNAL_FILE = 'journal.csv'
+
+# Columns for the journal
+JOURNAL_COLUMNS = [
+        "Key",
+        "Category",
+        "Timestamp",
+        "Correct?",
+        "Interval",
+        "Next review"
+        ]
+
+# Review stats for the forms drilled after a nominal or verb card
+FORM_STATS_FILE = 'form_stats.csv'
+
+# Backups: each file's contents are stored once, compressed, under
+# objects/ and named by their hash, and each snapshot is a manifest in
+# snapshots/ listing the hash of every data file
+BACKUP_DIR = 'backups'
+
+# Columns for the form stats file
+FORM_STATS_COLUMNS = [
+        "Category",
+        "Word",
+        "Form"
+        ]
 
 # Additional columns for nominals
 NOMINAL_COLUMNS = [
@@ -277,57 +435,1710 @@ VERB_FORMS = {
     "5th infinitive": ["[skip]", nan]
     }
 
-def backup_files():
-    """Backs up data files"""
-    ts = datetime.datetime.today()
-    day = ts.day if int(ts.day) > 9 else "0{}".format(ts.day)
-    month = ts.month if int(ts.month) > 9 else "0{}".format(ts.month)
-    timestamp = "_{}{}{}".format(ts.year, month, day)
-    newpath = r'backups/backup{}/'.format(timestamp) 
-    if not os.path.exists(newpath):
-        os.makedirs(newpath)
-    print(r"Backing up data files to /backups/backup{}".format(timestamp))
-    copy('verbs.csv', newpath)
-    copy('nominals.csv', newpath)
-    copy('invariants.csv', newpath)
-    copy('phrases.csv', newpath)
-    print("Backup completed")
-
-def load_invariants():
+# Verb forms that are quizzed
+QUIZ_VERB_FORMS = [form for form, (english, _) in VERB_FORMS.items() if
+                   english != "[skip]"]
+
+# Form columns of each category that has them
+FORM_COLUMNS = {
+        'nominal': list(NOMINAL_FORMS.keys()),
+        'verb': list(VERB_FORMS.keys())
+        }
+
+class PhaseTimer:
+    """How long each named phase of a session took, every time it ran"""
+
+    def __init__(self):
+        self.durations = {}
+
+    @contextlib.contextmanager
+    def phase(self, name):
+        """Time one run of a phase"""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.durations.setdefault(name, []).append(
+                    time.perf_counter() - start)
+
+    def summary(self):
+        """Count, total and latency percentiles in seconds for each phase"""
+        summary = {}
+        for name, durations in sorted(self.durations.items()):
+            p50, p90, p99 = np.percentile(durations, [50, 90, 99])
+            summary[name] = {'count': len(durations),
+                             'total': sum(durations),
+                             'mean': sum(durations) / len(durations),
+                             'p50': p50,
+                             'p90': p90,
+                             'p99': p99,
+                             'max': max(durations)}
+        return summary
+
+phase_timer = PhaseTimer()
+
+# Handed out for every phase when timing is off
+NO_PHASE = contextlib.nullcontext()
+
+def phase(name):
+    """Time a phase of the session when TIMING is set"""
+    if not TIMING:
+        return NO_PHASE
+    return phase_timer.phase(name)
+
+def timed(name):
+    """Decorator timing every call of a function as a phase"""
+    def decorator(function):
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            if not TIMING:
+                return function(*args, **kwargs)
+            with phase_timer.phase(name):
+                return function(*args, **kwargs)
+        return wrapper
+    return decorator
+
+def write_timings(path=None):
+    """Write the timing summary as JSON"""
+    if path is None:
+        path = TIMING_FILE
+    summary = phase_timer.summary()
+    with open(path, 'w') as timings_file:
+        json.dump(summary, timings_file, indent=2)
+    print("Wrote {}".format(path))
+    return summary
+
+def write_timings_at_exit():
+    """Write the timing summary if anything was timed"""
+    if TIMING and phase_timer.durations:
+        write_timings()
+
+# Registered before the deck's flush, so the timings written at exit
+# include it
+atexit.register(write_timings_at_exit)
+
+def backup_paths(formats=None):
+    """The data files that exist, to back up
+
+    formats are the storage formats whose files are included, by default
+    just STORAGE_FORMAT. Stats files kept apart by SPLIT_STATS are included
+    whenever they exist, so a restore can tell which ones to remove"""
+    if formats is None:
+        formats = [STORAGE_FORMAT]
+    paths = set()
+    for fmt in formats:
+        paths.update(data_path(cat, fmt) for cat in DATA_FILES)
+        paths.update(data_path(cat, fmt, 'stats') for cat in DATA_FILES)
+    paths.update([FORM_STATS_FILE, JOURNAL_FILE])
+    if os.path.isdir(LEARNERS_DIR):
+        paths.update(os.path.join(LEARNERS_DIR, name) for name in
+                     os.listdir(LEARNERS_DIR) if name.endswith('.csv'))
+    return sorted(path for path in paths if os.path.isfile(path))
+
+def file_hash(path):
+    """The sha256 of a file's contents"""
+    digest = hashlib.sha256()
+    with open(path, 'rb') as data_file:
+        for chunk in iter(lambda: data_file.read(1 << 20), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+def backup_object_path(digest):
+    """Where the compressed contents with a hash are kept"""
+    return os.path.join(BACKUP_DIR, 'objects', digest[:2],
+                        "{}.gz".format(digest))
+
+def backup_snapshots():
+    """The names of the backup snapshots, oldest first"""
+    snapshots_dir = os.path.join(BACKUP_DIR, 'snapshots')
+    if not os.path.isdir(snapshots_dir):
+        return []
+    return sorted(name[:-len('.json')] for name in os.listdir(snapshots_dir)
+                  if name.endswith('.json'))
+
+def load_manifest(snapshot):
+    """The manifest of a backup snapshot"""
+    with open(os.path.join(BACKUP_DIR, 'snapshots',
+                           "{}.json".format(snapshot))) as manifest_file:
+        return json.load(manifest_file)
+
+@timed('backup_files')
+def backup_files(formats=None):
+    """Backs up data files
+
+    formats are the storage formats backed up, by default just
+    STORAGE_FORMAT, which the snapshot records. Only files whose contents
+    aren't already stored are compressed and copied, and a file whose size
+    and modification time match the last snapshot isn't even read again.
+    No snapshot is made when nothing changed. Returns the snapshot's
+    name."""
+    snapshots = backup_snapshots()
+    last = load_manifest(snapshots[-1]) if snapshots else {}
+    files = {}
+    stored = 0
+    for path in backup_paths(formats):
+        stat = os.stat(path)
+        entry = {'size': stat.st_size, 'mtime_ns': stat.st_mtime_ns}
+        previous = last.get('files', {}).get(path, {})
+        if all(previous.get(key) == value for key, value in entry.items()):
+            entry['sha256'] = previous['sha256']
+        else:
+            entry['sha256'] = file_hash(path)
+        object_path = backup_object_path(entry['sha256'])
+        if not os.path.exists(object_path):
+            os.makedirs(os.path.dirname(object_path), exist_ok=True)
+            with open(path, 'rb') as data_file, \
+                 gzip.open(object_path + '.tmp', 'wb',
+                           compresslevel=6) as object_file:
+                for chunk in iter(lambda: data_file.read(1 << 20), b''):
+                    object_file.write(chunk)
+            os.replace(object_path + '.tmp', object_path)
+            stored += 1
+        files[path] = entry
+    if (snapshots and files == last['files'] and
+        last.get('storage_format') == STORAGE_FORMAT):
+        print("Nothing changed since backup {}".format(snapshots[-1]))
+        return snapshots[-1]
+    now = datetime.datetime.now()
+    snapshot = now.strftime('%Y%m%d-%H%M%S')
+    # Snapshots made within a second of each other get a count after them
+    count = 1
+    while snapshot + ('' if count == 1 else "-{}".format(count)) in \
+            snapshots:
+        count += 1
+    if count > 1:
+        snapshot = "{}-{}".format(snapshot, count)
+    snapshots_dir = os.path.join(BACKUP_DIR, 'snapshots')
+    os.makedirs(snapshots_dir, exist_ok=True)
+    with open(os.path.join(snapshots_dir, "{}.json".format(snapshot)),
+              'w') as manifest_file:
+        json.dump({'created': now.isoformat(),
+                   'storage_format': STORAGE_FORMAT,
+                   'files': files}, manifest_file, indent=2)
+    print("Backed up {} files to {}/snapshots/{}.json, {} of them changed"
+          .format(len(files), BACKUP_DIR, snapshot, stored))
+    return snapshot
+
+def restore_backup(snapshot=None):
+    """Restore the data files of a backup snapshot, by default the latest
+
+    The current files, of both the current storage format and the
+    snapshot's, are backed up first, so the restore can be undone. Once
+    every file is restored, data files of the snapshot's storage format
+    that weren't in it, like a journal started since, are removed so they
+    aren't applied on top of the restored tables. Files of other formats
+    are left alone."""
+    snapshots = backup_snapshots()
+    if snapshot is None and snapshots:
+        snapshot = snapshots[-1]
+    if snapshot not in snapshots:
+        print("No backup {}".format(snapshot))
+        return None
+    global current_deck
+    flush_deck()
+    current_deck = None
+    manifest = load_manifest(snapshot)
+    fmt = manifest.get('storage_format', manifest_format(manifest))
+    print("Backing up the current files first")
+    backup_files(sorted({STORAGE_FORMAT, fmt}))
+    failed = []
+    for path, entry in manifest['files'].items():
+        object_path = backup_object_path(entry['sha256'])
+        if not os.path.exists(object_path):
+            print("Missing the contents of {}".format(path))
+            failed.append(path)
+            continue
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        digest = hashlib.sha256()
+        try:
+            with replacing(path) as temp_path:
+                with gzip.open(object_path, 'rb') as object_file, \
+                     open(temp_path, 'wb') as data_file:
+                    for chunk in iter(lambda: object_file.read(1 << 20),
+                                      b''):
+                        digest.update(chunk)
+                        data_file.write(chunk)
+                # Raising leaves the current file in place
+                if digest.hexdigest() != entry['sha256']:
+                    raise ValueError("The backup of {} is corrupt"
+                                     .format(path))
+        except (ValueError, OSError, EOFError) as ex:
+            print(ex)
+            failed.append(path)
+    if failed:
+        print("Not restored: {}. Files not in the backup were kept"
+              .format(", ".join(failed)))
+        return False
+    for path in backup_paths([fmt]):
+        if path not in manifest['files']:
+            os.remove(path)
+            print("Removed {}".format(path))
+    print("Restored backup {}".format(snapshot))
+    if fmt != STORAGE_FORMAT:
+        print("The backup is in the {} format. Set STORAGE_FORMAT to {} to "
+              "use it".format(fmt, fmt))
+    return True
+
+def manifest_format(manifest):
+    """The storage format of a snapshot made before snapshots recorded it,
+    going by its data files"""
+    for fmt in ['csv', 'feather', 'parquet', 'sqlite']:
+        if any(data_path(cat, fmt) in manifest['files'] for
+               cat in DATA_FILES):
+            return fmt
+    return STORAGE_FORMAT
+
+def data_path(cat, fmt=None, part=None):
+    """Path of a category's data file
+
+    part 'stats' is the file of review stats kept apart with SPLIT_STATS.
+    The database holds both parts in one table."""
+    if fmt is None:
+        fmt = STORAGE_FORMAT
+    if fmt == 'sqlite':
+        return DATABASE_FILE
+    if part == 'stats':
+        return "{}_stats.{}".format(DATA_FILES[cat], fmt)
+    return "{}.{}".format(DATA_FILES[cat], fmt)
+
+def content_columns(cat):
+    """A category's columns other than its key and the stats"""
+    if cat == 'invariant':
+        return INVARIANT_COLUMNS[1:]
+    elif cat == 'nominal':
+        return NOMINAL_COLUMNS[1:] + FORM_COLUMNS[cat]
+    elif cat == 'verb':
+        return VERB_COLUMNS[1:] + FORM_COLUMNS[cat]
+    elif cat == 'phrase':
+        return PHRASE_COLUMNS
+
+def order_columns(words_df, cat):
+    """Put a category's columns in data file order: content, forms, stats"""
+    forms = FORM_COLUMNS.get(cat, [])
+    columns = ([column for column in words_df.columns if
+                column not in STATS and column not in forms] +
+               [column for column in forms if column in words_df.columns] +
+               [column for column in STATS if column in words_df.columns])
+    return words_df[columns]
+
+@timed('load')
+def read_table(cat, columns=None, fmt=None, part=None):
+    """Read a category's data file into a dataframe
+
+    columns limits the columns read, not counting the index. part 'content'
+    or 'stats' reads one part of a category split with SPLIT_STATS"""
+    if fmt is None:
+        fmt = STORAGE_FORMAT
+    path = data_path(cat, fmt, part)
+    index = INDEX_COLUMNS[cat]
+    if fmt == 'sqlite' and columns is None and part is not None:
+        columns = STATS if part == 'stats' else content_columns(cat)
+    if fmt == 'csv':
+        # The phrases index has no header in the csv
+        index = 'Unnamed: 0' if index is None else index
+        keep = None if columns is None else [index] + list(columns)
+        dates = [column for column in ['Last reviewed', 'Next review'] if
+                 part != 'content' and (keep is None or column in keep)]
+        words_df = pd.read_csv(path,
+                               index_col=0,
+                               usecols=(None if keep is None else 
+                                        lambda column: column in keep),
+                               parse_dates=dates,
+                               infer_datetime_format=True)
+        if 'Interval' in words_df.columns:
+            words_df['Interval'] = pd.to_timedelta(words_df['Interval'])
+        return words_df
+    index = 'index' if index is None else index
+    keep = None if columns is None else [index] + list(columns)
+    if fmt == 'feather':
+        words_df = pd.read_feather(path, columns=keep)
+    elif fmt == 'parquet':
+        words_df = pd.read_parquet(path, columns=keep)
+    elif fmt == 'sqlite':
+        words_df = read_sql_table(cat, keep)
+    else:
+        raise ValueError("Unknown storage format: {}".format(fmt))
+    words_df.set_index(index, inplace=True)
+    if INDEX_COLUMNS[cat] is None:
+        words_df.index.name = None
+    return words_df
+
+@contextlib.contextmanager
+def replacing(path):
+    """A temporary file to write instead of path, renamed over it once
+    written so a crash never leaves it half written
+
+    Each temporary file has a name of its own, so writers can't collide"""
+    fd, temp_path = tempfile.mkstemp(dir=os.path.dirname(path) or '.',
+                                     prefix=os.path.basename(path) + '.',
+                                     suffix='.tmp')
+    os.close(fd)
+    try:
+        yield temp_path
+        # Keep the permissions of the file being replaced
+        mode = os.stat(path).st_mode if os.path.exists(path) else 0o644
+        os.chmod(temp_path, mode & 0o777)
+        os.replace(temp_path, path)
+    finally:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+
+@timed('persistence')
+def write_table(words_df, cat, fmt=None, part=None):
+    """Write a category's dataframe to its data file
+
+    part 'content' or 'stats' writes one part of a category split with
+    SPLIT_STATS"""
+    if fmt is None:
+        fmt = STORAGE_FORMAT
+    path = data_path(cat, fmt, part)
+    if fmt == 'csv':
+        with replacing(path) as temp_path:
+            words_df.to_csv(temp_path)
+        return None
+    words_df = words_df.reset_index()
+    # Binary formats store the stats natively rather than as text
+    if part != 'content':
+        words_df['Last reviewed'] = pd.to_datetime(words_df['Last reviewed'])
+        words_df['Next review'] = pd.to_datetime(words_df['Next review'])
+        words_df['Interval'] = pd.to_timedelta(words_df['Interval'])
+        words_df['Correct?'] = words_df['Correct?'].astype(bool)
+    if fmt == 'feather':
+        with replacing(path) as temp_path:
+            words_df.to_feather(temp_path)
+    elif fmt == 'parquet':
+        with replacing(path) as temp_path:
+            words_df.to_parquet(temp_path, index=False)
+    elif fmt == 'sqlite':
+        write_sql_table(words_df, cat)
+    else:
+        raise ValueError("Unknown storage format: {}".format(fmt))
+
+def sql_name(name):
+    """Quote a table or column name for SQL"""
+    return '"{}"'.format(name)
+
+def sql_rows(words_df):
+    """Convert a dataframe with the index reset to rows for the database"""
+    words_df = words_df.copy()
+    for column in ['Last reviewed', 'Next review']:
+        if column in words_df.columns:
+            words_df[column] = (pd.to_datetime(words_df[column])
+                                .dt.strftime(SQL_DATE_FORMAT))
+    # Intervals are stored as nanoseconds
+    if 'Interval' in words_df.columns:
+        words_df['Interval'] = (pd.to_timedelta(words_df['Interval'])
+                                .values.astype('int64'))
+    if 'Correct?' in words_df.columns:
+        words_df['Correct?'] = words_df['Correct?'].astype(bool).astype(int)
+    words_df = words_df.astype(object).where(pd.notnull(words_df), None)
+    return list(words_df.itertuples(index=False, name=None))
+
+def read_sql_table(cat, columns=None):
+    """Read a category's table from the database"""
+    selection = "*" if columns is None else ", ".join(map(sql_name, columns))
+    query = "SELECT {} FROM {}".format(selection, sql_name(DATA_FILES[cat]))
+    con = sqlite3.connect(DATABASE_FILE)
+    try:
+        words_df = pd.read_sql_query(query, con)
+    finally:
+        con.close()
+    for column in ['Last reviewed', 'Next review']:
+        if column in words_df.columns:
+            words_df[column] = pd.to_datetime(words_df[column],
+                                              format=SQL_DATE_FORMAT)
+    if 'Interval' in words_df.columns:
+        words_df['Interval'] = pd.to_timedelta(words_df['Interval'])
+    if 'Correct?' in words_df.columns:
+        words_df['Correct?'] = words_df['Correct?'].astype(bool)
+    return words_df
+
+def write_sql_table(words_df, cat):
+    """Replace a category's table in the database
+
+    Takes the dataframe with its index reset"""
+    table = DATA_FILES[cat]
+    key = words_df.columns[0]
+    english = ENGLISH_COLUMNS[cat]
+    con = sqlite3.connect(DATABASE_FILE)
+    try:
+        with con:
+            con.execute("DROP TABLE IF EXISTS {}".format(sql_name(table)))
+            con.execute("CREATE TABLE {} ({} PRIMARY KEY, {})".format(
+                    sql_name(table), sql_name(key),
+                    ", ".join(map(sql_name, words_df.columns[1:]))))
+            con.execute("CREATE INDEX {} ON {} ({})".format(
+                    sql_name(table + "_english"), sql_name(table),
+                    sql_name(english)))
+            con.execute("CREATE INDEX {} ON {} ({})".format(
+                    sql_name(table + "_next_review"), sql_name(table),
+                    sql_name('Next review')))
+            con.executemany("INSERT INTO {} VALUES ({})".format(
+                    sql_name(table), ", ".join("?" * len(words_df.columns))),
+                    sql_rows(words_df))
+    finally:
+        con.close()
+
+@timed('persistence')
+def write_sql_rows(words_df, keys, cat, new=False, columns=None):
+    """Insert or update single rows of a category's table in the database"""
+    table = DATA_FILES[cat]
+    if columns is None:
+        columns = list(words_df.columns)
+    rows = words_df.loc[list(keys), columns].reset_index()
+    key = rows.columns[0]
+    if new:
+        statement = "INSERT INTO {} ({}) VALUES ({})".format(
+                sql_name(table),
+                ", ".join(map(sql_name, [key] + columns)),
+                ", ".join("?" * (len(columns) + 1)))
+        values = sql_rows(rows)
+    else:
+        statement = "UPDATE {} SET {} WHERE {} = ?".format(
+                sql_name(table),
+                ", ".join("{} = ?".format(sql_name(column)) for
+                          column in columns),
+                sql_name(key))
+        values = [row[1:] + row[:1] for row in sql_rows(rows)]
+    con = sqlite3.connect(DATABASE_FILE)
+    try:
+        with con:
+            con.executemany(statement, values)
+    finally:
+        con.close()
+
+def query_due(cat, now=None, sort=False, limit=None):
+    """Get the cards of a category that are due from the database"""
+    flush_deck(cat)
+    if now is None:
+        now = pd.to_datetime(datetime.datetime.now())
+    table = DATA_FILES[cat]
+    key = INDEX_COLUMNS[cat] if INDEX_COLUMNS[cat] is not None else 'index'
+    query = "SELECT {} FROM {} WHERE {} < ? ORDER BY {}".format(
+            sql_name(key), sql_name(table), sql_name('Next review'),
+            sql_name('Next review') if sort else sql_name(key))
+    parameters = [now.strftime(SQL_DATE_FORMAT)]
+    if limit is not None:
+        query += " LIMIT ?"
+        parameters.append(int(limit))
+    con = sqlite3.connect(DATABASE_FILE)
+    try:
+        due = [row[0] for row in con.execute(query, parameters)]
+    finally:
+        con.close()
+    return np.array(due, dtype=object)
+
+def query_in_file(word, cat, english=False):
+    """Check whether a word is in a category's table in the database"""
+    flush_deck(cat)
+    table = DATA_FILES[cat]
+    column = ENGLISH_COLUMNS[cat] if english else INDEX_COLUMNS[cat]
+    query = "SELECT 1 FROM {} WHERE {} = ? LIMIT 1".format(
+            sql_name(table), sql_name(column))
+    con = sqlite3.connect(DATABASE_FILE)
+    try:
+        found = con.execute(query, [word]).fetchone() is not None
+    finally:
+        con.close()
+    return found
+
+def migrate_storage(to_format, from_format='csv'):
+    """Copy every data file from one storage format to another
+
+    Set STORAGE_FORMAT to the new format to start using it. Unsaved changes
+    are flushed and pending reviews in the journal are compacted first."""
+    flush_deck()
+    if os.path.exists(JOURNAL_FILE):
+        compact_journal()
+    for cat in DATA_FILES:
+        write_data(read_data(cat, fmt=from_format), cat, fmt=to_format)
+        print("Wrote {}".format(data_path(cat, to_format)))
+    return True
+
+def read_data(cat, fmt=None):
+    """Read a category's content and stats together"""
+    if fmt is None:
+        fmt = STORAGE_FORMAT
+    if not SPLIT_STATS or fmt == 'sqlite':
+        return read_table(cat, fmt=fmt)
+    content = read_table(cat, fmt=fmt, part='content')
+    stats = read_table(cat, fmt=fmt, part='stats')
+    return order_columns(content.join(stats), cat)
+
+def write_data(words_df, cat, fmt=None, stats_only=False):
+    """Write a category's content and stats, to files of their own with
+    SPLIT_STATS
+
+    With stats_only, only the stats file is written when there is one"""
+    if fmt is None:
+        fmt = STORAGE_FORMAT
+    if not SPLIT_STATS or fmt == 'sqlite':
+        write_table(words_df, cat, fmt=fmt)
+        return None
+    write_table(words_df[STATS], cat, fmt=fmt, part='stats')
+    if not stats_only:
+        write_table(words_df.drop(columns=STATS), cat, fmt=fmt,
+                    part='content')
+
+def split_storage(fmt=None):
+    """Split each category's combined data file into a content file and a
+    stats file
+
+    The data files are backed up first. Set SPLIT_STATS to start using the
+    split files. The database needs no split, as it already updates just
+    the stats columns of a row."""
+    if fmt is None:
+        fmt = STORAGE_FORMAT
+    if fmt == 'sqlite':
+        print("The database needs no split")
+        return None
+    flush_deck()
+    if os.path.exists(JOURNAL_FILE):
+        compact_journal()
+    backup_files()
+    for cat in DATA_FILES:
+        words_df = read_table(cat, fmt=fmt)
+        write_table(words_df[STATS], cat, fmt=fmt, part='stats')
+        write_table(words_df.drop(columns=STATS), cat, fmt=fmt,
+                    part='content')
+        print("Wrote {} and {}".format(data_path(cat, fmt),
+                                       data_path(cat, fmt, 'stats')))
+    return True
+
+class Deck:
+    """The tables of a session, each loaded once and kept in memory
+
+    Changed rows are tracked per table and only written by flush, which also
+    runs at exit"""
+
+    def __init__(self):
+        self.tables = {}
+        # Per category: changed key -> changed columns, None for all
+        self.dirty = {}
+        # Per category: keys of rows not yet in the data file
+        self.new = {}
+        # Per word category: set of Finnish keys
+        self.keys = {}
+        # English synonym -> set of (category, key) of the cards it glosses
+        self.glosses = {}
+        # (category, key) -> the card's English synonyms
+        self.card_glosses = {}
+        # Per word category: English cell -> keys of the cards with it
+        self.english = {}
+        self.phrase_index = PhraseIndex()
+        # Verb -> its compiled quiz prompts
+        self.verb_prompts = {}
+        # Per category: its FormTable, when LONG_FORMS is set
+        self.forms = {}
+        # Per category: its FormStats, loaded on first use
+        self.form_stats = None
+        # Per category: its content, loaded on first use with SPLIT_STATS
+        self.contents = {}
+        # Per category: its DueHistogram, built on first use
+        self.due_days = {}
+        # Per category: a copy of the table as last written, which later
+        # writes bring up to date with just the changed rows. Only used with
+        # the write lock held
+        self.written = {}
+        # Held while the tables change or changes are taken to be written
+        self.lock = threading.RLock()
+        # Held from taking changes until they are written, so writes land in
+        # the order their changes were taken
+        self.write_lock = threading.RLock()
+        # The BackgroundWriter, with BACKGROUND_WRITES
+        self.writer = None
+
+    def table(self, cat, columns=None):
+        """The dataframe for a category, loaded on first use
+
+        With columns, a table that isn't loaded yet is only partly read and
+        isn't kept. With LONG_FORMS, the kept table has no form columns and
+        the forms are in self.forms. With SPLIT_STATS, the kept table only
+        has the stats, and anything more is joined from the content"""
+        if SPLIT_STATS:
+            words_df = self.stats(cat)
+            if columns is not None and set(columns) <= set(words_df.columns):
+                return words_df[columns]
+            words_df = self.full_table(cat)
+            return words_df if columns is None else words_df[columns]
+        if cat in self.tables:
+            words_df = self.tables[cat]
+            if columns is None:
+                return words_df
+            if not set(columns).issubset(words_df.columns):
+                words_df = self.full_table(cat)
+            return words_df[columns]
+        words_df = read_table(cat, columns=columns)
+        words_df.sort_index(inplace=True)
+        words_df = apply_journal(words_df, cat)
+        if columns is None:
+            words_df = self.keep_content(cat, words_df)
+            self.tables[cat] = words_df
+        return words_df
+
+    def stats(self, cat):
+        """The kept table with a category's review stats
+
+        With SPLIT_STATS it is read from the stats file alone and has only
+        the stats columns"""
+        if cat not in self.tables:
+            if not SPLIT_STATS:
+                return self.table(cat)
+            words_df = read_table(cat, part='stats')
+            words_df.sort_index(inplace=True)
+            self.tables[cat] = apply_journal(words_df, cat)
+        return self.tables[cat]
+
+    def content(self, cat):
+        """The kept table with a category's content, loaded on first use
+
+        Without SPLIT_STATS this is the category's whole table"""
+        if not SPLIT_STATS:
+            return self.table(cat)
+        if cat not in self.contents:
+            words_df = read_table(cat, part='content')
+            words_df.sort_index(inplace=True)
+            self.contents[cat] = self.keep_content(cat, words_df)
+        return self.contents[cat]
+
+    def keep_content(self, cat, words_df):
+        """Index the content of a newly loaded table, moving its forms to a
+        FormTable with LONG_FORMS"""
+        if LONG_FORMS and cat in FORM_COLUMNS:
+            self.forms[cat] = FormTable.from_wide(words_df,
+                                                  FORM_COLUMNS[cat])
+            words_df = words_df.drop(columns=FORM_COLUMNS[cat])
+        if cat in WORD_CATEGORIES:
+            self.index_cards(cat, words_df.index,
+                             words_df[ENGLISH_COLUMNS[cat]])
+        elif cat == 'phrase':
+            for phrase_i, finnish, english in zip(
+                    words_df.index, words_df['Finnish'],
+                    words_df['English']):
+                self.phrase_index.add(phrase_i, finnish, english)
+        return words_df
+
+    def index_cards(self, cat, keys, english):
+        """Add or update cards in the key set and the English gloss index"""
+        cat_keys = self.keys.setdefault(cat, set())
+        cells = self.english.setdefault(cat, {})
+        for key, card_english in zip(keys, english):
+            card = (cat, key)
+            old_glosses = self.card_glosses.pop(card, ())
+            if old_glosses:
+                cells[', '.join(old_glosses)].discard(key)
+            for gloss in old_glosses:
+                self.glosses[gloss].discard(card)
+            cat_keys.add(key)
+            glosses = split_glosses(card_english)
+            self.card_glosses[card] = glosses
+            if glosses:
+                cells.setdefault(card_english, set()).add(key)
+            for gloss in glosses:
+                self.glosses.setdefault(gloss, set()).add(card)
+
+    def has_card(self, cat, key):
+        """Check whether a category has a card for a Finnish key"""
+        self.content(cat)
+        return key in self.keys[cat]
+
+    def has_english(self, cat, english):
+        """Check whether a category has a card with exactly this English
+
+        Cards only sharing a synonym, like two words for "light", aren't
+        duplicates. cards_for finds those."""
+        self.content(cat)
+        return bool(self.english[cat].get(english))
+
+    def search_phrases(self, search, limit=None):
+        """Ranked phrases matching a search in English or Finnish"""
+        self.content('phrase')
+        return self.phrase_index.search(search, limit)
+
+    def full_table(self, cat, words_df=None):
+        """A category's table with all its columns, joining in the content
+        kept apart with SPLIT_STATS and the forms kept long with LONG_FORMS
+
+        words_df can be given to join them onto some of the rows"""
+        if words_df is None:
+            words_df = self.stats(cat)
+        joined = words_df
+        if SPLIT_STATS and set(joined.columns) <= set(STATS):
+            joined = joined.join(self.content(cat))
+        if cat in self.forms and FORM_COLUMNS[cat][0] not in joined.columns:
+            joined = joined.join(self.forms[cat].wide(joined.index))
+        if joined is words_df:
+            return words_df
+        return order_columns(joined, cat)
+
+    def row(self, cat, key):
+        """One card's row, including its content and forms"""
+        return self.full_table(cat, self.stats(cat).loc[[key]]).loc[key]
+
+    def form(self, cat, key, form_name):
+        """One form of a card"""
+        words_df = self.content(cat)
+        if cat in self.forms:
+            return self.forms[cat].form(key, form_name)
+        return words_df.loc[key, form_name]
+
+    def drills(self, cat):
+        """The form stats for a category"""
+        if self.form_stats is None:
+            self.form_stats = load_form_stats()
+        if cat not in self.form_stats:
+            self.form_stats[cat] = FormStats(FORM_COLUMNS[cat])
+        return self.form_stats[cat]
+
+    def prompts(self, verb, verb_row=None):
+        """A verb's quiz prompts, compiled the first time they're needed
+
+        They come from verb_row when it is given, and are compiled again
+        only if its content differs from the row they were compiled from"""
+        content = None
+        if verb_row is not None:
+            content = tuple(verb_row.drop(STATS, errors='ignore')
+                            .fillna('').astype(str))
+        cached = self.verb_prompts.get(verb)
+        if cached is None or (content is not None and
+                              cached[0] != content):
+            if verb_row is None:
+                verb_row = self.row('verb', verb)
+            cached = (content, compile_verb_prompts(verb_row))
+            self.verb_prompts[verb] = cached
+        return cached[1]
+
+    def cards_for(self, english):
+        """Every word card sharing an English synonym, as (category, key)"""
+        for cat in WORD_CATEGORIES:
+            self.table(cat)
+        cards = set()
+        for gloss in split_glosses(english):
+            cards.update(self.glosses.get(gloss, ()))
+        return sorted(cards)
+
+    def mark(self, cat, words_df, keys, new=False, columns=None):
+        """Note changed rows, taking words_df as the category's table"""
+        with self.lock:
+            if cat in self.forms and FORM_COLUMNS[cat][0] in words_df.columns:
+                self.forms[cat].update(
+                        words_df.loc[list(keys), FORM_COLUMNS[cat]])
+                words_df = words_df.drop(columns=FORM_COLUMNS[cat])
+            content = words_df
+            if SPLIT_STATS and not set(words_df.columns) <= set(STATS):
+                self.contents[cat] = words_df.drop(columns=STATS)
+                words_df = words_df[STATS]
+            self.tables[cat] = words_df
+            if cat in WORD_CATEGORIES and (new or columns is None or
+                                           ENGLISH_COLUMNS[cat] in columns):
+                self.index_cards(cat, keys,
+                                 content.loc[list(keys), ENGLISH_COLUMNS[cat]])
+            if cat == 'verb' and (new or columns is None or
+                                  not set(columns).issubset(STATS)):
+                for verb in keys:
+                    self.verb_prompts.pop(verb, None)
+            if cat == 'phrase' and (new or columns is None or
+                                    {'Finnish', 'English'} & set(columns)):
+                for phrase_i in keys:
+                    self.phrase_index.add(phrase_i,
+                                          content.loc[phrase_i, 'Finnish'],
+                                          content.loc[phrase_i, 'English'])
+            if new and cat in self.due_days:
+                self.due_days[cat].add(words_df.loc[list(keys), 'Next review'])
+            dirty = self.dirty.setdefault(cat, {})
+            added = self.new.setdefault(cat, set())
+            for key in keys:
+                if new:
+                    added.add(key)
+                elif key not in dirty or dirty[key] is None or columns is None:
+                    dirty[key] = None if columns is None else set(columns)
+                else:
+                    dirty[key].update(columns)
+
+    def due_histogram(self, cat):
+        """A category's DueHistogram"""
+        if cat not in self.due_days:
+            self.due_days[cat] = DueHistogram(
+                    self.stats(cat)['Next review'])
+        return self.due_days[cat]
+
+    def clean(self, cat):
+        """Forget a category's changes once they are written"""
+        self.dirty.pop(cat, None)
+        self.new.pop(cat, None)
+
+    def is_dirty(self, cat):
+        """Check whether a category has changes that aren't written"""
+        return bool(self.dirty.get(cat) or self.new.get(cat))
+
+    def flush(self, cat=None, quiet=False):
+        """Write the changed rows of one or every category
+
+        The database updates just those rows. Everything else rewrites the
+        table from a copy of it as last written. Only the changed rows are
+        copied under the lock, and they are put in the copy and written after
+        it is released, so a background writer doesn't hold up new answers.
+        The write lock is held throughout, so an older copy is never written
+        over a newer one."""
+        cats = list(self.tables) if cat is None else [cat]
+        for cat in cats:
+            with self.write_lock:
+                self.write_changes(cat, quiet)
+        with self.write_lock, self.lock:
+            if self.form_stats is not None and any(
+                    stats.dirty for stats in self.form_stats.values()):
+                save_form_stats(self.form_stats)
+                if not quiet:
+                    print("Saved {}".format(FORM_STATS_FILE))
+
+    def write_changes(self, cat, quiet=False):
+        """Write one category's changes, with the write lock held"""
+        with self.lock:
+            if not self.is_dirty(cat):
+                return None
+            words_df = self.tables[cat]
+            dirty = self.dirty.pop(cat, {})
+            added = self.new.pop(cat, set())
+            to_file = (STORAGE_FORMAT != 'sqlite' or
+                       os.path.exists(JOURNAL_FILE))
+            if to_file:
+                stats_only = not added and all(
+                        columns is not None and columns <= set(STATS)
+                        for columns in dirty.values())
+                whole = not (stats_only and SPLIT_STATS)
+                written = self.written.pop(cat, None)
+                # Journaled reviews aren't noted as changes, so with a
+                # journal the whole table is taken
+                if (written is None or os.path.exists(JOURNAL_FILE) or
+                    (whole and set(written.columns) <= set(STATS))):
+                    if whole:
+                        words_df = self.full_table(cat, words_df)
+                    words_df = words_df.copy()
+                    written = None
+                else:
+                    keys = [key for key in dict.fromkeys(list(dirty) +
+                                                         list(added))
+                            if key in words_df.index]
+                    if stats_only:
+                        rows = words_df.loc[keys, STATS]
+                    else:
+                        rows = self.full_table(cat, words_df.loc[keys])
+            else:
+                new_keys = [key for key in added if
+                            key in words_df.index]
+                new_rows = self.full_table(cat,
+                                           words_df.loc[new_keys])
+                changed = {key: columns for key, columns in
+                           dirty.items() if key not in added}
+                columns = set()
+                for key_columns in changed.values():
+                    if key_columns is None:
+                        columns = None
+                        break
+                    columns.update(key_columns)
+                rows = words_df.loc[list(changed)]
+                if columns is None or not columns <= set(rows.columns):
+                    rows = self.full_table(cat, rows)
+        try:
+            if to_file:
+                if written is not None:
+                    words_df = self.with_rows(written, rows)
+                write_data(words_df, cat, stats_only=stats_only)
+                self.written[cat] = words_df
+                clear_journal(cat)
+                message = "Saved {}".format(
+                        data_path(cat, part='stats' if SPLIT_STATS and
+                                  stats_only else None))
+            else:
+                if new_keys:
+                    write_sql_rows(new_rows, new_keys, cat, new=True)
+                if changed:
+                    write_sql_rows(rows, list(changed), cat,
+                                   columns=None if columns is None else
+                                   [column for column in rows.columns
+                                    if column in columns])
+                message = "Saved {} {} rows".format(
+                        len(new_keys) + len(changed), cat)
+        except BaseException:
+            with self.lock:
+                self.restore(cat, dirty, added)
+            raise
+        if not quiet:
+            print(message)
+
+    @staticmethod
+    def with_rows(words_df, rows):
+        """A table with rows put over its own, and added when it lacks them"""
+        known = rows.index.isin(words_df.index)
+        words_df.loc[rows.index[known], rows.columns] = rows[known]
+        if not known.all():
+            words_df = pd.concat([words_df, rows[~known]])
+        return words_df
+
+    def restore(self, cat, dirty, added):
+        """Note changes again after writing them failed"""
+        self.new.setdefault(cat, set()).update(added)
+        current = self.dirty.setdefault(cat, {})
+        for key, columns in dirty.items():
+            if key not in current:
+                current[key] = columns
+            elif columns is None or current[key] is None:
+                current[key] = None
+            else:
+                current[key].update(columns)
+
+    def changed(self):
+        """Tell the background writer about a change, if there is one"""
+        if self.writer is not None:
+            self.writer.notify()
+
+class BackgroundWriter:
+    """Writes a deck's changes from a thread of its own
+
+    The changes go out WRITE_DELAY seconds after the last one, so a burst
+    of them is one write, or as soon as WRITE_WINDOW of them are waiting.
+    Noting a change waits while WRITE_WINDOW are still unwritten, so a
+    crash loses at most that many answers."""
+
+    def __init__(self, deck, delay=None, window=None):
+        self.deck = deck
+        self.delay = WRITE_DELAY if delay is None else delay
+        self.window = WRITE_WINDOW if window is None else window
+        self.condition = threading.Condition()
+        # Changes not yet written
+        self.pending = 0
+        self.last_change = 0
+        self.stopped = False
+        # Changes aren't waited on while writing them fails
+        self.failed = False
+        self.thread = threading.Thread(target=self.run, daemon=True,
+                                       name='finncards-writer')
+
+    def start(self):
+        """Start the writer thread"""
+        self.thread.start()
+        return self
+
+    def notify(self):
+        """Note a change, waiting first if the window is full"""
+        with self.condition:
+            while (self.pending >= self.window and self.thread.is_alive()
+                   and not self.stopped and not self.failed):
+                self.condition.notify_all()
+                self.condition.wait()
+            self.pending += 1
+            self.last_change = time.monotonic()
+            self.condition.notify_all()
+
+    def run(self):
+        """Write the changes until stopped"""
+        while True:
+            with self.condition:
+                while not self.stopped:
+                    wait = self.last_change + self.delay - time.monotonic()
+                    if self.pending and (self.pending >= self.window or
+                                         wait <= 0):
+                        break
+                    self.condition.wait(wait if self.pending else None)
+                if self.stopped:
+                    return None
+                taken = self.pending
+            try:
+                self.deck.flush(quiet=True)
+            except Exception as error:
+                print("Background write failed: {}".format(error))
+                with self.condition:
+                    self.failed = True
+                    self.last_change = time.monotonic()
+                    self.condition.notify_all()
+                continue
+            with self.condition:
+                self.failed = False
+                self.pending -= taken
+                self.condition.notify_all()
+
+    def stop(self):
+        """Stop the writer thread and write what is left"""
+        with self.condition:
+            self.stopped = True
+            self.condition.notify_all()
+        if self.thread.is_alive():
+            self.thread.join()
+        self.deck.flush()
+        with self.condition:
+            self.pending = 0
+            self.condition.notify_all()
+
+class FormTable:
+    """Inflected forms in long format, one (word, form, value) per form
+
+    Each value is split into a head, the words up to its last space (like
+    "en " or "olisin "), the length of the prefix it shares with its word,
+    and an ending. Heads and endings are shared by many forms, so they are
+    dictionary encoded and each row holds small integer codes instead of a
+    string. Empty forms are left out. Rows are sorted by word, and
+    self.starts gives where each word's rows begin, so the word codes
+    themselves aren't stored."""
+
+    def __init__(self, form_names):
+        self.form_names = pd.Index(form_names)
+        self.words = pd.Index([], dtype=object)
+        self.heads = np.empty(0, dtype=object)
+        self.endings = np.empty(0, dtype=object)
+        self.form_codes = np.empty(0, dtype=np.int16)
+        self.head_codes = np.empty(0, dtype=np.int16)
+        self.stem_lengths = np.empty(0, dtype=np.uint8)
+        self.ending_codes = np.empty(0, dtype=np.int32)
+        self.starts = np.zeros(1, dtype=np.int64)
+
+    @classmethod
+    def from_wide(cls, words_df, form_names):
+        """Build a form table from the form columns of a wide dataframe"""
+        table = cls(form_names)
+        table.update(words_df[form_names])
+        return table
+
+    @staticmethod
+    def split_value(word, value):
+        """Split a form into its head, stem length and ending"""
+        space = value.rfind(" ") + 1
+        head, rest = value[:space], value[space:]
+        length = 0
+        for word_char, char in zip(word[:255], rest):
+            if word_char != char:
+                break
+            length += 1
+        return head, length, rest[length:]
+
+    @staticmethod
+    def encode(dictionary, values):
+        """Codes of values in a dictionary array, extending it with any new
+        values"""
+        # Only a temporary index is hashed, so the dictionary stays a plain
+        # array between updates
+        codes = pd.Index(dictionary).get_indexer(values)
+        if (codes < 0).any():
+            dictionary = np.concatenate(
+                    [dictionary, pd.unique(values[codes < 0])])
+            codes = pd.Index(dictionary).get_indexer(values)
+        return dictionary, codes
+
+    def update(self, wide):
+        """Add the forms of words in a wide dataframe, replacing any they
+        already had"""
+        old_word_codes = self.word_codes
+        known = self.words.get_indexer(wide.index)
+        keep = ~np.isin(old_word_codes, known[known >= 0])
+        self.words = self.words.append(
+                pd.Index(wide.index[known < 0], dtype=object))
+        cells = wide.to_numpy(dtype=object).ravel()
+        present = pd.notnull(cells) & (cells != "")
+        word_codes = np.repeat(self.words.get_indexer(wide.index),
+                               wide.shape[1])[present]
+        form_codes = np.tile(self.form_names.get_indexer(wide.columns),
+                             wide.shape[0])[present]
+        words = np.repeat(np.asarray(wide.index, dtype=object),
+                          wide.shape[1])[present]
+        parts = [self.split_value(word, value) for word, value in
+                 zip(words, cells[present])]
+        heads = np.array([head for head, _, _ in parts], dtype=object)
+        endings = np.array([ending for _, _, ending in parts], dtype=object)
+        stem_lengths = np.array([length for _, length, _ in parts],
+                                dtype=np.uint8)
+        self.heads, head_codes = self.encode(self.heads, heads)
+        self.endings, ending_codes = self.encode(self.endings, endings)
+        word_codes = np.concatenate([old_word_codes[keep], word_codes])
+        form_codes = np.concatenate([self.form_codes[keep], form_codes])
+        head_codes = np.concatenate([self.head_codes[keep], head_codes])
+        stem_lengths = np.concatenate([self.stem_lengths[keep],
+                                       stem_lengths])
+        ending_codes = np.concatenate([self.ending_codes[keep],
+                                       ending_codes])
+        order = np.lexsort((form_codes, word_codes))
+        self.form_codes = form_codes[order].astype(np.int16)
+        self.head_codes = head_codes[order].astype(np.int16)
+        self.stem_lengths = stem_lengths[order]
+        self.ending_codes = ending_codes[order].astype(np.int32)
+        self.starts = np.searchsorted(word_codes[order],
+                                      np.arange(len(self.words) + 1))
+
+    @property
+    def word_codes(self):
+        """The word code of each row"""
+        return np.repeat(np.arange(len(self.words)), np.diff(self.starts))
+
+    def values(self, rows, word_codes=None):
+        """The forms held in some rows"""
+        if word_codes is None:
+            word_codes = self.word_codes[rows]
+        return np.array([head + word[:length] + ending for
+                         head, word, length, ending in
+                         zip(self.heads[self.head_codes[rows]],
+                             self.words[word_codes],
+                             self.stem_lengths[rows],
+                             self.endings[self.ending_codes[rows]])],
+                        dtype=object)
+
+    def word_rows(self, word):
+        """The slice of rows holding a word's forms"""
+        code = self.words.get_loc(word)
+        return slice(self.starts[code], self.starts[code + 1])
+
+    def word_forms(self, word):
+        """A word's forms as a series indexed by form name"""
+        rows = self.word_rows(word)
+        word_codes = np.full(rows.stop - rows.start,
+                             self.words.get_loc(word))
+        return pd.Series(self.values(rows, word_codes),
+                         index=self.form_names[self.form_codes[rows]],
+                         dtype=object)
+
+    def form(self, word, form_name):
+        """One form of a word, nan when it has none"""
+        rows = self.word_rows(word)
+        form_codes = self.form_codes[rows]
+        code = self.form_names.get_loc(form_name)
+        found = np.searchsorted(form_codes, code)
+        if found == len(form_codes) or form_codes[found] != code:
+            return nan
+        row = rows.start + found
+        return (self.heads[self.head_codes[row]] +
+                word[:self.stem_lengths[row]] +
+                self.endings[self.ending_codes[row]])
+
+    def form_column(self, form_name):
+        """One form of every word that has it, indexed by word"""
+        rows = np.flatnonzero(self.form_codes ==
+                              self.form_names.get_loc(form_name))
+        return pd.Series(self.values(rows),
+                         index=self.words[self.word_codes[rows]],
+                         dtype=object)
+
+    def wide(self, words=None):
+        """The forms as a wide dataframe, for callers expecting columns"""
+        if words is None:
+            words = self.words
+        codes = self.words.get_indexer(words)
+        positions = np.full(len(self.words), -1)
+        positions[codes[codes >= 0]] = np.flatnonzero(codes >= 0)
+        word_codes = self.word_codes
+        rows = np.flatnonzero(positions[word_codes] >= 0)
+        cells = np.full((len(words), len(self.form_names)), nan,
+                        dtype=object)
+        cells[positions[word_codes[rows]],
+              self.form_codes[rows]] = self.values(rows, word_codes[rows])
+        return pd.DataFrame(cells, index=words, columns=self.form_names)
+
+    def memory_usage(self):
+        """Bytes used by the codes and the dictionaries"""
+        return (self.form_codes.nbytes + self.head_codes.nbytes +
+                self.stem_lengths.nbytes + self.ending_codes.nbytes +
+                self.starts.nbytes + self.words.memory_usage(deep=True) +
+                self.heads.nbytes + self.endings.nbytes +
+                sum(sys.getsizeof(part) for part in self.heads) +
+                sum(sys.getsizeof(part) for part in self.endings))
+
+class FormStats:
+    """Review stats for the (word, form) pairs of a category
+
+    Only pairs that have been drilled are kept, in parallel arrays sorted
+    by a pair code: the word's code times the number of forms plus the
+    form's code. A pair that was never drilled takes no space."""
+
+    # The stats arrays, parallel to the codes
+    COLUMNS = ['last_reviewed', 'next_review', 'intervals', 'correct',
+               'times_correct', 'times_incorrect']
+
+    def __init__(self, form_names):
+        self.form_names = pd.Index(form_names)
+        self.words = pd.Index([], dtype=object)
+        self.codes = np.empty(0, dtype=np.int64)
+        self.last_reviewed = np.empty(0, dtype='datetime64[ns]')
+        self.next_review = np.empty(0, dtype='datetime64[ns]')
+        self.intervals = np.empty(0, dtype='timedelta64[ns]')
+        self.correct = np.empty(0, dtype=bool)
+        self.times_correct = np.empty(0, dtype=np.int32)
+        self.times_incorrect = np.empty(0, dtype=np.int32)
+        # Pair code -> stats of a pair first drilled since the last merge
+        self.pending = {}
+        self.dirty = False
+
+    def pair_codes(self, words, form_names):
+        """Pair codes for parallel arrays of words and form names, adding
+        any words not seen yet"""
+        words = pd.Index(words, dtype=object)
+        new_words = words[self.words.get_indexer(words) < 0].unique()
+        if len(new_words):
+            self.words = self.words.append(new_words)
+        return (self.words.get_indexer(words).astype(np.int64) *
+                len(self.form_names) +
+                self.form_names.get_indexer(form_names))
+
+    def find(self, word, form_name, now):
+        """A pair's stats as one-element views, to change in place
+
+        A pair that hasn't been drilled before gets new card stats, kept
+        pending until merge puts it in the sorted arrays"""
+        code = self.pair_codes([word], [form_name])[0]
+        i = np.searchsorted(self.codes, code)
+        if i < len(self.codes) and self.codes[i] == code:
+            return [getattr(self, name)[i:i + 1] for name in self.COLUMNS]
+        if code not in self.pending:
+            self.pending[code] = [
+                    np.array([now], dtype='datetime64[ns]'),
+                    np.array([now], dtype='datetime64[ns]'),
+                    np.array([np.timedelta64(1, 'D')],
+                             dtype='timedelta64[ns]'),
+                    np.array([True]),
+                    np.zeros(1, dtype=np.int32),
+                    np.zeros(1, dtype=np.int32)]
+        return self.pending[code]
+
+    def merge(self):
+        """Merge the pending pairs into the sorted arrays, all in one go"""
+        if not self.pending:
+            return None
+        codes = np.concatenate([self.codes, np.fromiter(
+                self.pending, dtype=np.int64, count=len(self.pending))])
+        order = np.argsort(codes, kind='stable')
+        self.codes = codes[order]
+        for name, pending in zip(self.COLUMNS, zip(*self.pending.values())):
+            setattr(self, name, np.concatenate(
+                    [getattr(self, name)] + list(pending))[order])
+        self.pending = {}
+
+    def review(self, word, form_name, correct, now=None):
+        """Apply an answer for a pair, with the same rules as
+        process_correct and process_incorrect"""
+        if now is None:
+            now = pd.Timestamp.now()
+        now = np.datetime64(pd.Timestamp(now), 'ns')
+        (last_reviewed, next_review, intervals, was_correct, times_correct,
+         times_incorrect) = self.find(word, form_name, now)
+        last_reviewed[0] = now
+        if correct:
+            intervals[0] = correct_intervals(intervals, was_correct)[0]
+            next_review[0] = now + intervals[0]
+            times_correct[0] += 1
+        else:
+            intervals[0] = incorrect_intervals(intervals)[0]
+            times_incorrect[0] += 1
+        was_correct[0] = correct
+        self.dirty = True
+        return pd.Timestamp(next_review[0])
+
+    def due(self, now=None, words=None):
+        """The drilled pairs that are due, most overdue first"""
+        if now is None:
+            now = pd.Timestamp.now()
+        self.merge()
+        due = self.next_review < np.datetime64(pd.Timestamp(now), 'ns')
+        if words is not None:
+            word_codes = self.words.get_indexer(pd.Index(words,
+                                                         dtype=object))
+            due &= np.isin(self.codes // len(self.form_names), word_codes)
+        rows = np.flatnonzero(due)
+        rows = rows[np.argsort(self.next_review[rows], kind='stable')]
+        return pd.DataFrame({
+                'Word': self.words[self.codes[rows] // len(self.form_names)],
+                'Form': self.form_names[self.codes[rows] %
+                                        len(self.form_names)],
+                'Next review': self.next_review[rows]})
+
+    def seen(self, word):
+        """The forms of a word that have been drilled"""
+        self.merge()
+        if word not in self.words:
+            return self.form_names[:0]
+        first = self.words.get_loc(word) * len(self.form_names)
+        start, stop = np.searchsorted(self.codes,
+                                      [first, first + len(self.form_names)])
+        return self.form_names[self.codes[start:stop] - first]
+
+    def to_frame(self, cat):
+        """The stats as rows for the form stats file"""
+        self.merge()
+        return pd.DataFrame({
+                'Category': cat,
+                'Word': self.words[self.codes // len(self.form_names)],
+                'Form': self.form_names[self.codes % len(self.form_names)],
+                'Last reviewed': self.last_reviewed,
+                'Next review': self.next_review,
+                'Interval': pd.to_timedelta(self.intervals),
+                'Correct?': self.correct,
+                'Times correct': self.times_correct,
+                'Times incorrect': self.times_incorrect},
+                columns=FORM_STATS_COLUMNS + STATS)
+
+    @classmethod
+    def from_frame(cls, rows, form_names):
+        """Stats from rows of the form stats file"""
+        stats = cls(form_names)
+        rows = rows[stats.form_names.get_indexer(rows['Form']) >= 0]
+        codes = stats.pair_codes(rows['Word'], rows['Form'])
+        order = np.argsort(codes, kind='stable')
+        stats.codes = codes[order]
+        stats.last_reviewed = pd.to_datetime(
+                rows['Last reviewed']).values[order]
+        stats.next_review = pd.to_datetime(rows['Next review']).values[order]
+        stats.intervals = pd.to_timedelta(rows['Interval']).values[order]
+        stats.correct = rows['Correct?'].values.astype(bool)[order]
+        stats.times_correct = rows['Times correct'].values.astype(
+                np.int32)[order]
+        stats.times_incorrect = rows['Times incorrect'].values.astype(
+                np.int32)[order]
+        return stats
+
+def trigrams(text):
+    """The set of three-character substrings of a padded, lowercase text"""
+    if not isinstance(text, str):
+        return set()
+    text = " {} ".format(text.lower())
+    return set(text[i:i+3] for i in range(len(text) - 2))
+
+class DueHistogram:
+    """The number of cards due on each day, kept up to date as cards are
+    rescheduled
+
+    Days are counted from the epoch, and the counts start at the earliest
+    day seen"""
+
+    def __init__(self, next_reviews=()):
+        days = self.days(next_reviews)
+        self.origin = int(days.min()) if len(days) else self.day(
+                datetime.datetime.now())
+        self.counts = np.bincount(days - self.origin)
+
+    @staticmethod
+    def days(timestamps):
+        """The day numbers of some timestamps, leaving out missing ones"""
+        timestamps = np.asarray(pd.to_datetime(timestamps), dtype='M8[ns]')
+        timestamps = timestamps[~np.isnat(timestamps)]
+        return timestamps.astype('M8[D]').astype(np.int64)
+
+    @classmethod
+    def day(cls, timestamp):
+        """The day number of a timestamp"""
+        return int(np.datetime64(pd.Timestamp(timestamp), 'D')
+                   .astype(np.int64))
+
+    def reserve(self, first, last):
+        """Make room for counts from day first to day last"""
+        if first < self.origin:
+            # Grow by at least the current size so growing stays cheap
+            extra = max(self.origin - first, len(self.counts))
+            self.counts = np.concatenate([np.zeros(extra, dtype=np.int64),
+                                          self.counts])
+            self.origin -= extra
+        end = last - self.origin + 1
+        if end > len(self.counts):
+            extra = max(end - len(self.counts), len(self.counts))
+            self.counts = np.concatenate([self.counts,
+                                          np.zeros(extra, dtype=np.int64)])
+
+    def add(self, next_reviews):
+        """Count more cards"""
+        days = self.days(next_reviews)
+        if len(days):
+            self.reserve(days.min(), days.max())
+            np.add.at(self.counts, days - self.origin, 1)
+
+    def remove(self, next_reviews):
+        """Stop counting some cards"""
+        days = self.days(next_reviews) - self.origin
+        days = days[(days >= 0) & (days < len(self.counts))]
+        np.subtract.at(self.counts, days, 1)
+        np.maximum(self.counts, 0, out=self.counts)
+
+    def move(self, old, new):
+        """Move a card from the day of one review to the day of another"""
+        old_day = self.day(old) - self.origin if not pd.isna(old) else -1
+        if 0 <= old_day < len(self.counts) and self.counts[old_day] > 0:
+            self.counts[old_day] -= 1
+        self.add([new])
+
+    def window(self, first, last):
+        """The counts from day first to day last"""
+        self.reserve(first, last)
+        return self.counts[first - self.origin:last - self.origin + 1]
+
+    def least_loaded(self, first, last, target):
+        """The day from first to last with the fewest cards due, the
+        nearest to target on a tie"""
+        days = np.arange(first, last + 1)
+        best = np.lexsort((np.abs(days - target), self.window(first, last)))
+        return int(days[best[0]])
+
+class PhraseIndex:
+    """Trigram index over the English and Finnish text of the phrases
+
+    Matches tolerate typos, since a phrase only needs to share most of a
+    search's trigrams"""
+
+    def __init__(self):
+        # Trigram -> set of phrase indices containing it
+        self.postings = {}
+        # Phrase index -> (trigrams, lowercase English, lowercase Finnish)
+        self.phrases = {}
+
+    def add(self, phrase_i, finnish, english):
+        """Add a phrase, replacing what was indexed for it before"""
+        self.remove(phrase_i)
+        grams = trigrams(english) | trigrams(finnish)
+        self.phrases[phrase_i] = (grams,
+                                  str(english).lower(), str(finnish).lower())
+        for gram in grams:
+            self.postings.setdefault(gram, set()).add(phrase_i)
+
+    def remove(self, phrase_i):
+        """Remove a phrase from the index"""
+        if phrase_i not in self.phrases:
+            return None
+        for gram in self.phrases.pop(phrase_i)[0]:
+            self.postings[gram].discard(phrase_i)
+
+    def search(self, search, limit=None):
+        """Phrases matching a search as (phrase index, score), best first
+
+        Phrases containing the search exactly rank first, then by the share
+        of the search's trigrams they contain"""
+        grams = trigrams(search)
+        if not grams:
+            return []
+        shared = {}
+        for gram in grams:
+            for phrase_i in self.postings.get(gram, ()):
+                shared[phrase_i] = shared.get(phrase_i, 0) + 1
+        search = search.lower()
+        matches = []
+        for phrase_i, count in shared.items():
+            score = count / len(grams)
+            _, english, finnish = self.phrases[phrase_i]
+            exact = search in english or search in finnish
+            if exact or score >= PHRASE_SEARCH_THRESHOLD:
+                matches.append((not exact, -score, phrase_i))
+        matches.sort()
+        return [(phrase_i, -score) for _, score, phrase_i in
+                matches[:limit]]
+
+def split_glosses(english):
+    """Split an English cell into its synonyms"""
+    if not isinstance(english, str):
+        return ()
+    return tuple(english.split(', '))
+
+current_deck = None
+
+def get_deck():
+    """The session's deck, created on first use"""
+    global current_deck
+    if current_deck is None:
+        current_deck = Deck()
+        if BACKGROUND_WRITES and not USE_JOURNAL:
+            current_deck.writer = BackgroundWriter(current_deck).start()
+            exit_on_signals()
+    return current_deck
+
+def flush_deck(cat=None):
+    """Write any unsaved changes in the session's deck"""
+    if current_deck is None:
+        return None
+    if cat is None and current_deck.writer is not None:
+        current_deck.writer.stop()
+    else:
+        current_deck.flush(cat)
+
+def exit_on_signals():
+    """Exit normally on SIGTERM and SIGHUP, so the changes are written"""
+    if threading.current_thread() is not threading.main_thread():
+        return None
+    for name in ['SIGTERM', 'SIGHUP']:
+        if hasattr(signal, name):
+            signal.signal(getattr(signal, name),
+                          lambda signum, frame: sys.exit(128 + signum))
+
+atexit.register(flush_deck)
+
+def load_invariants(columns=None):
     """Loads the invariants file"""
-    invariants = pd.read_csv('invariants.csv',
-                            index_col='Finnish',
-                            parse_dates=['Last reviewed', 'Next review'],
-                            infer_datetime_format=True)
-    invariants.sort_index(inplace=True)
-    return invariants
-
-def load_nominals():
+    return get_deck().table('invariant', columns)
+
+def load_nominals(columns=None):
     """Load the nominals file"""
-    nominals = pd.read_csv('nominals.csv',
-                        index_col="Nominative singular",
-                        parse_dates=["Last reviewed", "Next review"],
-                        infer_datetime_format=True)
-    nominals.sort_index(inplace=True)
-    return nominals
-
-def load_verbs():
+    return get_deck().table('nominal', columns)
+
+def load_verbs(columns=None):
     """Loads the verbs file"""
-    verbs = pd.read_csv('verbs.csv',
-                        index_col="Infinitive",
-                        parse_dates=["Last reviewed", "Next review"],
-                        infer_datetime_format=True)
-    verbs.sort_index(inplace=True)
-    return verbs
-
-def load_phrases():
+    return get_deck().table('verb', columns)
+
+def load_phrases(columns=None):
     """Loads the phrases file"""
-    phrases = pd.read_csv('phrases.csv', 
-                          index_col=0,
-                          parse_dates=["Last reviewed", "Next review"],
-                          infer_datetime_format=True)
-    phrases.sort_index(inplace=True)
-    return phrases
+    return get_deck().table('phrase', columns)
+
+def load_stats(cat):
+    """Loads a category's review stats, without its content when
+    SPLIT_STATS is set"""
+    return get_deck().stats(cat)
+
+def save_table(words_df, cat, stats_only=False):
+    """Write a category's dataframe to its data file
+
+    The written file already includes any journaled reviews for the category,
+    so they are dropped from the journal. With stats_only, only the stats
+    file is written when SPLIT_STATS keeps one."""
+    if current_deck is None:
+        write_data(words_df, cat, stats_only=stats_only)
+        clear_journal(cat)
+        return None
+    with current_deck.write_lock:
+        with current_deck.lock:
+            table = words_df
+            if not (stats_only and SPLIT_STATS):
+                table = current_deck.full_table(cat, words_df)
+            table = table.copy()
+        write_data(table, cat, stats_only=stats_only)
+        clear_journal(cat)
+        if current_deck.tables.get(cat) is words_df:
+            current_deck.written[cat] = table
+            current_deck.clean(cat)
+
+@timed('persistence')
+def append_journal(word, words_df, cat, correct):
+    """Append the result of a review to the journal"""
+    new_file = not os.path.exists(JOURNAL_FILE)
+    if not new_file:
+        with open(JOURNAL_FILE, encoding='utf-8') as journal:
+            if journal.readline().rstrip('\r\n') != ','.join(
+                    JOURNAL_COLUMNS):
+                upgrade_journal()
+    with open(JOURNAL_FILE, 'a', newline='', encoding='utf-8') as journal:
+        writer = csv.writer(journal)
+        if new_file:
+            writer.writerow(JOURNAL_COLUMNS)
+        writer.writerow([word, cat, words_df.loc[word, 'Last reviewed'],
+                         correct,
+                         pd.to_timedelta(words_df.loc[word, 'Interval']),
+                         words_df.loc[word, 'Next review']])
+
+def upgrade_journal():
+    """Add the next reviews to a journal written before they were kept
+
+    They were the review time plus the interval then"""
+    journal = load_journal()
+    journal['Interval'] = pd.to_timedelta(journal['Interval'])
+    journal['Next review'] = journal['Timestamp'] + journal['Interval']
+    with replacing(JOURNAL_FILE) as temp_path:
+        journal[JOURNAL_COLUMNS].to_csv(temp_path, index=False)
+
+def load_form_stats():
+    """Loads the form stats file"""
+    if not os.path.exists(FORM_STATS_FILE):
+        return {}
+    rows = pd.read_csv(FORM_STATS_FILE,
+                       dtype={'Word': str},
+                       keep_default_na=False,
+                       parse_dates=['Last reviewed', 'Next review'])
+    return {cat: FormStats.from_frame(cat_rows, FORM_COLUMNS[cat]) for
+            cat, cat_rows in rows.groupby('Category') if cat in FORM_COLUMNS}
+
+@timed('persistence')
+def save_form_stats(form_stats):
+    """Saves the form stats of every category to the form stats file"""
+    with replacing(FORM_STATS_FILE) as temp_path:
+        pd.concat([stats.to_frame(cat) for cat, stats in
+                   form_stats.items()]).to_csv(temp_path, index=False)
+    for stats in form_stats.values():
+        stats.dirty = False
+
+def load_journal():
+    """Loads the journal file"""
+    journal = pd.read_csv(JOURNAL_FILE,
+                          dtype={'Key': str},
+                          keep_default_na=False)
+    for column in ['Timestamp', 'Next review']:
+        if column in journal.columns:
+            journal[column] = pd.to_datetime(journal[column])
+    return journal
+
+def apply_journal(words_df, cat):
+    """Fold the journaled reviews for a category into its dataframe"""
+    if (not os.path.exists(JOURNAL_FILE) or
+        not set(STATS).issubset(words_df.columns)):
+        return words_df
+    journal = load_journal()
+    journal = journal[journal['Category'] == cat].copy()
+    if journal.empty:
+        return words_df
+    if pd.api.types.is_integer_dtype(words_df.index):
+        journal['Key'] = journal['Key'].astype(int)
+    journal = journal[journal['Key'].isin(words_df.index)].copy()
+    journal['Interval'] = pd.to_timedelta(journal['Interval'])
+    reviews = journal.groupby('Key', sort=False)
+    last = reviews.last()
+    words_df.loc[last.index, 'Last reviewed'] = last['Timestamp']
+    words_df.loc[last.index, 'Interval'] = last['Interval']
+    words_df.loc[last.index, 'Correct?'] = last['Correct?']
+    # Only correct answers move the next review
+    last_correct = journal[journal['Correct?']].groupby('Key').last()
+    if 'Next review' in journal.columns:
+        words_df.loc[last_correct.index, 'Next review'] = (
+                last_correct['Next review'])
+    else:
+        words_df.loc[last_correct.index, 'Next review'] = (
+                last_correct['Timestamp'] + last_correct['Interval'])
+    times_correct = reviews['Correct?'].sum()
+    times_incorrect = reviews['Correct?'].count() - times_correct
+    words_df.loc[last.index, 'Times correct'] += times_correct
+    words_df.loc[last.index, 'Times incorrect'] += times_incorrect
+    return words_df
+
+def clear_journal(cat):
+    """Drop a category's reviews from the journal"""
+    if not os.path.exists(JOURNAL_FILE):
+        return None
+    journal = load_journal()
+    journal = journal[journal['Category'] != cat]
+    if journal.empty:
+        os.remove(JOURNAL_FILE)
+    else:
+        journal.to_csv(JOURNAL_FILE, index=False)
+
+def compact_journal():
+    """Fold the whole journal into the data files"""
+    if not os.path.exists(JOURNAL_FILE):
+        print("Journal is empty")
+        return None
+    for cat in DATA_FILES:
+        save_table(load_stats(cat), cat, stats_only=True)
+    print("Journal compacted")
+    return True
+
+def save_rows(words_df, keys, cat, new=False, columns=None):
+    """Record changes to some rows of a category's dataframe
+
+    They are written when the session's deck is flushed"""
+    deck = get_deck()
+    deck.mark(cat, words_df, keys, new=new, columns=columns)
+    deck.changed()
+
+def save_review(word, words_df, cat, correct):
+    """Persist the result of a single review"""
+    if USE_JOURNAL and STORAGE_FORMAT != 'sqlite':
+        append_journal(word, words_df, cat, correct)
+    else:
+        save_rows(words_df, [word], cat, columns=STATS)
+
+def load_table(cat):
+    """Load the dataframe for a category"""
+    if cat == 'invariant':
+        return load_invariants()
+    elif cat == 'nominal':
+        return load_nominals()
+    elif cat == 'verb':
+        return load_verbs()
+    elif cat == 'phrase':
+        return load_phrases()
 
 def in_file(word=None, words_df=None, category="", english=False):
     """Checks to see if a word is in a given file"""
@@ -335,13 +2146,14 @@ def in_file(word=None, words_df=None, category="", english=False):
         word = input("Word: ").lower()
     while category not in ['invariant', 'nominal', 'verb']:
         category = input("Category: ").lower()
-    if words_df is None:
-        if category == 'invariant':
-            words_df = load_invariants()
-        elif category == 'nominal':
-            words_df = load_nominals()
-        elif category == 'verb':
-            words_df = load_verbs()
+    deck = get_deck()
+    if (words_df is None and STORAGE_FORMAT == 'sqlite' and
+        category not in deck.tables):
+        return query_in_file(word, category, english=english)
+    if words_df is None or words_df is deck.tables.get(category):
+        if english:
+            return deck.has_english(category, word)
+        return deck.has_card(category, word)
     if english:
         if category == 'verb':
             return (True if word in list(words_df['English present']) else 
@@ -351,6 +2163,11 @@ def in_file(word=None, words_df=None, category="", english=False):
     else:
         return True if word in list(words_df.index) else False
 
+def cards_with_english(english):
+    """Find the word cards that share an English synonym"""
+    return get_deck().cards_for(english)
+
+@timed('save_invariant')
 def save_invariant(invariant=None, english=None):
     """Save an invariant and at it to the file"""
     invariants = load_invariants()
@@ -383,13 +2200,14 @@ def save_invariant(invariant=None, english=None):
     invariants = invariants.append(entry, verify_integrity=True)
     conf = input("Adding {}. Continue? ".format(invariant)).lower()
     if conf == 'y':
-        invariants.to_csv('invariants.csv')
+        save_rows(invariants, [invariant], 'invariant', new=True)
         print("File saved")
         return True
     else:
         print("No updates made")
         return None
     
+@timed('save_nominal')
 def save_nominal(nominal=None, english=None, forms=None):
     """Save a nominal and its forms to the file"""
     nominals = load_nominals()
@@ -415,20 +2233,21 @@ def save_nominal(nominal=None, english=None, forms=None):
     times_incorrect = 0
     stats = [last_reviewed, next_review, interval, correct, times_correct,
              times_incorrect]
-    data = [nominal, english] + forms + stats
+    data = [nominal, english] + list(forms) + stats
     columns = NOMINAL_COLUMNS + list(NOMINAL_FORMS.keys()) + STATS
     entry = pd.DataFrame(data=[data], columns=columns)
     entry.set_index(keys="Nominative singular", inplace=True)
     nominals = nominals.append(entry, verify_integrity=True)
     conf = input("Adding {}. Continue? ".format(nominal)).lower()
     if conf == 'y':
-        nominals.to_csv('nominals.csv')
+        save_rows(nominals, [nominal], 'nominal', new=True)
         print("File saved")
         return True
     else:
         print("No updates made")
         return None
     
+@timed('save_verb')
 def save_verb(verb=None, english=None, forms=None):
     """Save a verb and its forms to the file"""
     verbs = load_verbs()
@@ -468,20 +2287,21 @@ def save_verb(verb=None, english=None, forms=None):
     stats = [last_reviewed, next_review, interval, correct, times_correct,
              times_incorrect]
     data = [verb, e_present, e_simple_past, e_past_part, 
-            e_present_part] + forms + stats
+            e_present_part] + list(forms) + stats
     columns = VERB_COLUMNS + list(VERB_FORMS.keys()) + STATS
     entry = pd.DataFrame(data=[data], columns=columns)
     entry.set_index(keys="Infinitive", inplace=True)
     verbs = verbs.append(entry, verify_integrity=True)
     conf = input("Adding {}. Continue? ".format(verb)).lower()
     if conf == 'y':
-        verbs.to_csv('verbs.csv')
+        save_rows(verbs, [verb], 'verb', new=True)
         print("File saved")
         return True
     else:
         print("No updates made")
         return None
     
+@timed('save_phrase')
 def save_phrase(phrase=None, english=None):
     """Save a phrase to the file"""
     if phrase is None:
@@ -504,33 +2324,316 @@ def save_phrase(phrase=None, english=None):
     phrases.reset_index(drop=True, inplace=True)
     conf = input("Adding phrase. Continue? ").lower()
     if conf == 'y':
-        phrases.to_csv('phrases.csv')
+        save_rows(phrases, [phrases.index[-1]], 'phrase', new=True)
         print("File saved")
         return True
     else:
         return None
 
-def retrieve_nominal(nominal, skip_save=False):
-    """Get a noun's forms from wiktionary"""
+@timed('fetch')
+def fetch_page(word, check=False):
+    """Fetch a word's Wiktionary page
+
+    With check, an error status raises an exception"""
+    from requests_html import HTMLSession
     session = HTMLSession()
-    link_string = "https://en.wiktionary.org/wiki/{}".format(nominal)
-    try:
-        r = session.get(link_string)
-    except Exception as ex:
-        print("There was a problem getting the web page: {}".format(ex))
+    r = session.get(WIKTIONARY_URL.format(word))
+    if check:
+        r.raise_for_status()
+    return r.text
+
+def page_revision(html):
+    """Get the revision ID of a Wiktionary page"""
+    match = re.search(r'"wgRevisionId":\s*(\d+)', html)
+    return int(match.group(1)) if match else 0
+
+def load_cache_index():
+    """Loads the index of cached pages"""
+    path = os.path.join(CACHE_DIR, 'index.json')
+    if not os.path.exists(path):
+        return {}
+    with open(path, encoding='utf-8') as index_file:
+        return json.load(index_file)
+
+def save_cache_index(cache):
+    """Saves the index of cached pages"""
+    if not os.path.exists(CACHE_DIR):
+        os.makedirs(CACHE_DIR)
+    path = os.path.join(CACHE_DIR, 'index.json')
+    with replacing(path) as temp_path:
+        with open(temp_path, 'w', encoding='utf-8') as index_file:
+            json.dump(cache, index_file, ensure_ascii=False)
+
+def read_cached_page(entry):
+    """Read a page from the cache"""
+    with gzip.open(os.path.join(CACHE_DIR, entry['file']), 'rt',
+                   encoding='utf-8') as page:
+        return page.read()
+
+def remove_cached_page(cache, word):
+    """Remove a word's page from the cache"""
+    entry = cache.pop(word)
+    path = os.path.join(CACHE_DIR, entry['file'])
+    if os.path.exists(path):
+        os.remove(path)
+
+def cache_page(cache, word, revision, html):
+    """Add a page to the cache, replacing any older revision"""
+    if word in cache:
+        remove_cached_page(cache, word)
+    if not os.path.exists(CACHE_DIR):
+        os.makedirs(CACHE_DIR)
+    name = hashlib.sha1(word.encode('utf-8')).hexdigest()[:16]
+    entry = {
+            'revision': revision,
+            'fetched': str(pd.to_datetime(datetime.datetime.now())),
+            'file': "{}-{}.html.gz".format(name, revision),
+            'forms': {},
+            'extractor': EXTRACTOR_VERSION
+            }
+    path = os.path.join(CACHE_DIR, entry['file'])
+    with gzip.open(path, 'wt', encoding='utf-8') as page:
+        page.write(html)
+    entry['size'] = os.path.getsize(path)
+    cache[word] = entry
+    return entry
+
+def evict_cache(cache):
+    """Evict pages that are too old, then the oldest until under size"""
+    now = pd.to_datetime(datetime.datetime.now())
+    by_age = sorted(cache, key=lambda word: cache[word]['fetched'])
+    size = sum(entry['size'] for entry in cache.values())
+    for word in by_age:
+        if (size <= CACHE_MAX_BYTES and
+            now - pd.to_datetime(cache[word]['fetched']) <= CACHE_MAX_AGE):
+            break
+        size -= cache[word]['size']
+        remove_cached_page(cache, word)
+
+def cache_is_fresh(entry):
+    """Check whether a cached page can be used without fetching it again"""
+    if entry is None:
+        return False
+    age = pd.to_datetime(datetime.datetime.now()) - pd.to_datetime(
+            entry['fetched'])
+    return CACHE_OFFLINE or age < CACHE_REFRESH
+
+# Held while the cache index is read, or merged into and saved, so lookups
+# in several threads don't lose each other's entries. Pages are fetched
+# without it.
+cache_lock = threading.Lock()
+
+def lookup_forms(word, cat, fetch=None, cache=None):
+    """Get a word's forms, using the cached page when possible
+
+    When a cache index is passed in, saving it is left to the caller"""
+    if cache is None:
+        with cache_lock:
+            cache = load_cache_index()
+        forms = lookup_forms(word, cat, fetch, cache)
+        with cache_lock:
+            # Other lookups may have saved the index during this one
+            saved = load_cache_index()
+            if word in cache:
+                saved[word] = cache[word]
+            evict_cache(saved)
+            save_cache_index(saved)
+        return forms
+    if fetch is None:
+        fetch = fetch_page
+    entry = cache.get(word)
+    if entry is not None and entry.get('extractor') != EXTRACTOR_VERSION:
+        entry['forms'] = {}
+        entry['extractor'] = EXTRACTOR_VERSION
+    now = pd.to_datetime(datetime.datetime.now())
+    if cache_is_fresh(entry):
+        if cat in entry['forms']:
+            return entry['forms'][cat]
+        html = read_cached_page(entry)
+    elif CACHE_OFFLINE:
+        print("No cached page for {}".format(word))
         return None
-    soup = BeautifulSoup(r.text, 'html.parser')
-    forms = []
-    for key, value in NOMINAL_FORMS.items():
+    else:
         try:
-            span = soup.find(class_=value)
-            link = span.find('a')
-            form = link['title'].split(" ")[0]
-            forms.append(form)
+            html = fetch(word)
         except Exception as ex:
-            print("There was a problem finding {}: {}".format(key, ex))
-            forms.append("")
+            print("There was a problem getting the web page: {}".format(ex))
+            return None
+        revision = page_revision(html)
+        if entry is not None and entry['revision'] == revision:
+            entry['fetched'] = str(now)
+        else:
+            entry = cache_page(cache, word, revision, html)
+    if cat not in entry['forms']:
+        entry['forms'][cat] = extract_forms(html, cat)
+    return entry['forms'][cat]
+
+@timed('parse')
+def extract_forms(html, cat, report=True):
+    """Get a nominal's or verb's forms from its Wiktionary page
+
+    Only the parts of the page holding forms are parsed, and they are walked
+    once"""
+    if cat == 'nominal':
+        return extract_nominal_forms(html, report)
+    elif cat == 'verb':
+        return extract_verb_forms(html, report)
+
+def extract_nominal_forms(html, report=True):
+    """Get a noun's forms from its Wiktionary page"""
+    from bs4 import BeautifulSoup, SoupStrainer
+    wanted = {value: key for key, value in NOMINAL_FORMS.items()}
+    found = {}
+    only_forms = SoupStrainer('span',
+                              class_=re.compile(r'(^|\s)form-of(\s|$)'))
+    soup = BeautifulSoup(html, HTML_PARSER, parse_only=only_forms)
+    for span in soup.find_all('span'):
+        key = wanted.get(" ".join(span.get('class', [])))
+        if key is None or key in found:
             continue
+        link = span.find('a')
+        if link is not None and link.has_attr('title'):
+            found[key] = link['title'].split(" ")[0]
+    forms = []
+    for key in NOMINAL_FORMS:
+        if key not in found and report:
+            print("There was a problem finding {}".format(key))
+        forms.append(found.get(key, ""))
+    return forms
+
+def extract_verb_forms(html, report=True):
+    """Get a verb's forms from the conjugation table on its Wiktionary page"""
+    from bs4 import BeautifulSoup, SoupStrainer
+    only_frames = SoupStrainer('div', class_=re.compile(r'\bNavFrame\b'))
+    soup = BeautifulSoup(html, HTML_PARSER, parse_only=only_frames)
+    table = None
+    for head in soup.find_all('div', class_='NavHead'):
+        if head.get_text().strip().startswith("Conjugation of"):
+            table = head.find_next_sibling(class_='NavContent')
+            break
+    if table is None:
+        if report:
+            print("There was a problem finding the conjugation table")
+        return []
+    forms = []
+    # One form per cell, the first where a cell gives alternatives
+    for cell in table.find_all('td'):
+        span = cell.find(lang='fi')
+        if span is not None:
+            forms.append(span.get_text())
+        if len(forms) == len(VERB_FORMS):
+            break
+    return forms
+
+def iter_dump_pages(path):
+    """Stream (title, HTML) pairs from a local Wiktionary dump
+
+    Takes either an XML export whose page text is rendered HTML or an
+    Enterprise HTML dump with one JSON page per line (.ndjson or .jsonl),
+    optionally compressed with gzip or bz2. Pages are read one at a time."""
+    if path.endswith('.gz'):
+        dump = gzip.open(path, 'rb')
+    elif path.endswith('.bz2'):
+        dump = bz2.open(path, 'rb')
+    else:
+        dump = open(path, 'rb')
+    with dump:
+        if '.ndjson' in path or '.jsonl' in path:
+            for line in dump:
+                page = json.loads(line)
+                yield page['name'], page['article_body']['html']
+            return
+        pages = ElementTree.iterparse(dump, events=('start', 'end'))
+        _, root = next(pages)
+        for event, element in pages:
+            if event != 'end' or not element.tag.endswith('page'):
+                continue
+            title = html = None
+            for child in element.iter():
+                if child.tag.endswith('title'):
+                    title = child.text
+                elif child.tag.endswith('text'):
+                    html = child.text
+            if title and html:
+                yield title, html
+            # Drop parsed pages to keep memory flat
+            root.clear()
+
+# Finnish inflection templates, which only a page's wikitext holds. Their
+# forms are generated when the page is rendered, so they can't be read from
+# the template call
+WIKITEXT_TEMPLATE = re.compile(r'\{\{fi-(?:decl|conj)-')
+
+def ingest_page(page):
+    """Extract the nominal and verb forms from one dump page
+
+    The forms are None for a page of unrendered wikitext"""
+    title, html = page
+    if WIKITEXT_TEMPLATE.search(html):
+        return title, None
+    forms = {}
+    if "Conjugation of" in html:
+        verb_forms = extract_verb_forms(html, report=False)
+        if verb_forms:
+            forms['verb'] = verb_forms + [""] * (len(VERB_FORMS) -
+                                                 len(verb_forms))
+    if "form-of" in html:
+        nominal_forms = extract_nominal_forms(html, report=False)
+        if any(nominal_forms):
+            forms['nominal'] = nominal_forms
+    return title, forms
+
+def ingest_dump(path, words=None, processes=None, chunksize=16):
+    """Extract forms for every word in a local Wiktionary dump
+
+    The pages are spread over a pool of processes. words limits the pages
+    to those headwords. Returns a dict with a 'nominal' and a 'verb' table
+    of forms indexed by headword, so that e.g.
+    save_nominal(word, forms=tables['nominal'].loc[word]) works.
+
+    The dump must be rendered HTML. The pages-articles XML dumps hold
+    wikitext, whose inflection templates don't list the forms; such pages
+    are skipped and counted."""
+    from multiprocessing import Pool
+    if processes is None:
+        processes = INGEST_PROCESSES
+    if words is not None:
+        words = set(words)
+    pages = ((title, html) for title, html in iter_dump_pages(path) if
+             words is None or title in words)
+    found = {'nominal': {}, 'verb': {}}
+    wikitext = 0
+    with Pool(processes) as pool:
+        for title, forms in pool.imap_unordered(ingest_page, pages,
+                                                chunksize):
+            if forms is None:
+                wikitext += 1
+                continue
+            for cat, cat_forms in forms.items():
+                found[cat][title] = cat_forms
+    tables = {
+            'nominal': pd.DataFrame.from_dict(
+                    found['nominal'], orient='index',
+                    columns=list(NOMINAL_FORMS.keys())),
+            'verb': pd.DataFrame.from_dict(
+                    found['verb'], orient='index',
+                    columns=list(VERB_FORMS.keys()))
+            }
+    for table in tables.values():
+        table.sort_index(inplace=True)
+    print("Found forms for {} nominals and {} verbs".format(
+            len(tables['nominal']), len(tables['verb'])))
+    if wikitext:
+        print("Skipped {} pages of wikitext. Use a dump of rendered HTML, "
+              "like an Enterprise HTML dump".format(wikitext))
+    return tables
+
+@timed('retrieve_nominal')
+def retrieve_nominal(nominal, skip_save=False):
+    """Get a noun's forms from wiktionary"""
+    forms = lookup_forms(nominal, 'nominal')
+    if forms is None:
+        return None
     print(*forms, sep=', ')
     nominals = load_nominals()
     if not skip_save and nominal not in nominals.index:
@@ -539,28 +2642,12 @@ def retrieve_nominal(nominal, skip_save=False):
             save_nominal(nominal, forms=forms)
     return forms
 
+@timed('retrieve_verb')
 def retrieve_verb(verb, skip_save=False):
     """Get a verb's forms from wiktionary"""
-    session = HTMLSession()
-    link_string = "https://en.wiktionary.org/wiki/{}".format(verb)
-    try:
-        r = session.get(link_string)
-    except Exception as ex:
-        print("There was a problem getting the web page: {}".format(ex))
+    forms = lookup_forms(verb, 'verb')
+    if forms is None:
         return None
-    soup = BeautifulSoup(r.text, 'html.parser')
-    spans=soup.find_all(lang='fi')
-    adding = False
-    forms = []
-    for span in spans:
-        # First valid entry will be first person singular 
-        # which will always end in an 'n'
-        if span.text[-1] == 'n' and span.parent.name == 'td':
-            adding = True
-        if adding:
-            forms.append(span.text)
-    # There are extraneous entries at the end
-    forms = forms[:157]
     print(*forms, sep=', ')
     verbs = load_verbs()
     if not skip_save and verb not in verbs.index:
@@ -602,6 +2689,112 @@ def add_phrases():
             return None
         save_phrase(english=phrase)
 
+async def fetch_pages(words):
+    """Fetch Wiktionary pages concurrently
+
+    Keeps to IMPORT_CONCURRENCY fetches in flight and IMPORT_RATE fetches
+    started per second, retrying with backoff. A page that can't be
+    fetched maps to the last exception raised for it."""
+    import asyncio
+    loop = asyncio.get_running_loop()
+    pool = asyncio.Semaphore(IMPORT_CONCURRENCY)
+    schedule = {'next': loop.time()}
+    async def wait_turn():
+        now = loop.time()
+        start = max(now, schedule['next'])
+        schedule['next'] = start + 1 / IMPORT_RATE
+        await asyncio.sleep(start - now)
+    async def fetch(word):
+        async with pool:
+            for attempt in range(IMPORT_ATTEMPTS):
+                await wait_turn()
+                try:
+                    return await loop.run_in_executor(None, fetch_page,
+                                                      word, True)
+                except Exception as ex:
+                    error = ex
+                if attempt < IMPORT_ATTEMPTS - 1:
+                    await asyncio.sleep(IMPORT_BACKOFF * 2 ** attempt)
+            return error
+    pages = await asyncio.gather(*[fetch(word) for word in words])
+    return dict(zip(words, pages))
+
+def new_stats():
+    """Statistics for a card that has not been reviewed yet"""
+    now = pd.Timestamp(pd.to_datetime(datetime.datetime.now()))
+    return [now, now, pd.to_timedelta("1 days"), True, 0, 0]
+
+def import_words(path):
+    """Add words in bulk from a csv with Finnish, Category and English columns
+
+    Verbs take their four English forms separated by semicolons. Pages for
+    the nominals and verbs are fetched concurrently and each table is saved
+    once. Returns the words that could not be added or whose forms are
+    incomplete."""
+    import asyncio
+    rows = pd.read_csv(path, dtype=str, keep_default_na=False)
+    rows['Category'] = rows['Category'].str.lower().str[0].map(
+            {'i': 'invariant', 'n': 'nominal', 'v': 'verb'})
+    failed = list(rows.loc[rows['Category'].isnull(), 'Finnish'])
+    tables = {cat: load_table(cat) for cat in rows['Category'].dropna()}
+    cache = load_cache_index()
+    to_fetch = [word for word, cat in zip(rows['Finnish'], rows['Category'])
+                if cat in ['nominal', 'verb'] and
+                word not in tables[cat].index and
+                not cache_is_fresh(cache.get(word))]
+    print("Fetching {} pages".format(len(to_fetch)))
+    pages = asyncio.run(fetch_pages(to_fetch))
+    def fetch(word):
+        if isinstance(pages.get(word), Exception):
+            raise pages[word]
+        return pages[word]
+    for cat, cat_rows in rows.groupby('Category', sort=False):
+        words_df = tables[cat]
+        entries = []
+        for finnish, english in zip(cat_rows['Finnish'], cat_rows['English']):
+            if finnish in words_df.index or finnish in [
+                    entry[0] for entry in entries]:
+                print("{} already in file".format(finnish))
+                continue
+            if cat == 'invariant':
+                entries.append([finnish, english, "", ""] + new_stats())
+                continue
+            if cat == 'verb':
+                english = english.split(';')
+                if len(english) != 4:
+                    print("Wrong number of entries in English list for {}"
+                          .format(finnish))
+                    failed.append(finnish)
+                    continue
+                english = [form.strip() for form in english]
+            else:
+                english = [english]
+            forms = lookup_forms(finnish, cat, fetch=fetch, cache=cache)
+            if not forms:
+                failed.append(finnish)
+                continue
+            if "" in forms:
+                failed.append(finnish)
+            entries.append([finnish] + english + forms + new_stats())
+        if not entries:
+            continue
+        if cat == 'invariant':
+            columns = INVARIANT_COLUMNS + STATS
+        elif cat == 'nominal':
+            columns = NOMINAL_COLUMNS + list(NOMINAL_FORMS.keys()) + STATS
+        elif cat == 'verb':
+            columns = VERB_COLUMNS + list(VERB_FORMS.keys()) + STATS
+        entries = pd.DataFrame(data=entries, columns=columns)
+        entries.set_index(keys=columns[0], inplace=True)
+        words_df = pd.concat([words_df, entries], verify_integrity=True)
+        save_rows(words_df, list(entries.index), cat, new=True)
+        print("Added {} {}s".format(len(entries), cat))
+    evict_cache(cache)
+    save_cache_index(cache)
+    if failed:
+        print("Failed or incomplete: {}".format(", ".join(failed)))
+    return failed
+
 def edit_word(word=None, cat=None):
     """Edit an word entry"""
     if word is None:
@@ -612,24 +2805,21 @@ def edit_word(word=None, cat=None):
             cat = input("Category: ").lower()
     if cat == 'invariant':
         words = load_invariants()
-        save_string = 'invariants.csv'
     elif cat == 'nominal':
         words = load_nominals()
-        save_string = 'nominals.csv'
     elif cat == 'verb':
         words = load_verbs()
-        save_string = 'verbs.csv'
-    if word not in words.index():
+    if word not in words.index:
         print("No entry for {}".format(word))
         return None
-    current_english = words.loc[word, 'english']
+    current_english = words.loc[word, ENGLISH_COLUMNS[cat]]
     print("{}: {}".format(word, current_english))
     new_english = input("New value: ").lower()
     print("{}: {}".format(word, new_english))
     conf = input("Update entry?: ").lower()
     if conf == 'y':
-        words.loc[word, 'english'] = new_english
-        words.to_csv(save_string)
+        words.loc[word, ENGLISH_COLUMNS[cat]] = new_english
+        save_rows(words, [word], cat, columns=[ENGLISH_COLUMNS[cat]])
         print("File saved")
         return True
 
@@ -638,125 +2828,420 @@ def edit_phrase(search=None, cat=None):
     if search is None:
         search = input("Search (English): ").lower()
     phrases = load_phrases()
-    english_list = list(phrases['English'])
-    matches = []
-    for english in english_list:
-        if search in english:
-            matches.append(english)
-            finnish = list(phrases[phrases['English'] == 
-                                   english]['Finnish'])[0]
-            print("{}. {}: {}".format(len(matches), english, finnish))
+    matches = [phrase_i for phrase_i, _ in
+               get_deck().search_phrases(search)]
+    if not matches:
+        print("No phrases match {}".format(search))
+        return None
+    for number, phrase_i in enumerate(matches, 1):
+        print("{}. {}: {}".format(number, phrases.loc[phrase_i, 'English'],
+                                  phrases.loc[phrase_i, 'Finnish']))
     selection = -1
     while selection not in range(1, len(matches)+1):
         selection = int(input("Selection: "))
-    english = matches[selection-1]
+    index = matches[selection-1]
+    english = phrases.loc[index, 'English']
     new_finnish = input("New Finnish: ").lower()
-    index = phrases[phrases['English'] == english].index.values[0]
     print("{}: {}".format(english, new_finnish))
     conf = input("Update entry?: ").lower()
     if conf == 'y':
         phrases.loc[index, 'Finnish'] = new_finnish
-        phrases.to_csv('phrases.csv')
+        save_rows(phrases, [index], 'phrase', columns=['Finnish'])
         print("File saved")
         return True
 
-def generate_words_list(load_all=True):
-    """Generate a list of words to review"""
-    invariants = load_invariants()
-    nominals = load_nominals()
-    verbs = load_verbs()
+def date_values(column):
+    """A column's values as datetime64, only parsing them when they aren't
+    already"""
+    if column.dtype.kind == 'M':
+        return column.values
+    return pd.to_datetime(column).values
+
+def due_cards(words_df, now=None, sort=False, limit=None):
+    """Get the index labels of the cards in a dataframe that are due
+
+    With sort, the most overdue cards come first. limit caps the number of
+    cards returned."""
+    if now is None:
+        now = pd.to_datetime(datetime.datetime.now())
+    next_review = date_values(words_df['Next review'])
+    due = np.flatnonzero(next_review < np.datetime64(now))
+    if sort:
+        due = due[np.argsort(next_review[due], kind='stable')]
+    if limit is not None:
+        due = due[:limit]
+    return words_df.index.values[due]
+
+@timed('due selection')
+def select_due(words_df, cat, now=None, sort=False, limit=None):
+    """Get the due cards of a category, using the database when there is one"""
+    if STORAGE_FORMAT == 'sqlite':
+        return query_due(cat, now, sort, limit)
+    return due_cards(words_df, now, sort, limit)
+
+def due_forecast(days=30, now=None, cats=None):
+    """The number of cards of each category due on each of the next days
+
+    Overdue cards count towards today."""
+    if now is None:
+        now = pd.to_datetime(datetime.datetime.now())
+    today = np.datetime64(pd.Timestamp(now), 'D')
+    forecast = {}
+    for cat in cats or DATA_FILES:
+        next_review = date_values(load_stats(cat)['Next review'])
+        next_review = next_review[~np.isnat(next_review)]
+        offsets = np.maximum((next_review.astype('M8[D]') - today)
+                             .astype(np.int64), 0)
+        forecast[cat] = np.bincount(offsets[offsets < days], minlength=days)
+    return pd.DataFrame(forecast,
+                        index=pd.date_range(pd.Timestamp(today),
+                                            periods=days, name='Day'))
+
+def balance_review(cat, now, interval):
+    """The next review of a card answered now, moved to the least loaded
+    day near its due date
+
+    The review can move by LOAD_BALANCE_FUZZ of its interval, and by at
+    least a day once the interval is two days, up to LOAD_BALANCE_DAYS
+    days. It stays at least a day away and within MAXIMUM_INTERVAL. Only
+    the review moves, so the card's interval grows as it would have."""
+    histogram = get_deck().due_histogram(cat)
+    days = interval / pd.to_timedelta('1 days')
+    # Even short intervals can move a day, so a batch of new cards spreads
+    # out from its first reviews
+    window = min(max(int(days * LOAD_BALANCE_FUZZ), 1 if days >= 2 else 0),
+                 LOAD_BALANCE_DAYS)
+    target = histogram.day(now + interval)
+    if window == 0:
+        return now + interval
+    first = max(target - window, histogram.day(now) + 1)
+    last = min(target + window, histogram.day(now + MAXIMUM_INTERVAL))
+    day = histogram.least_loaded(first, last, target)
+    return now + interval + pd.to_timedelta(day - target, unit='D')
+
+def generate_words_list(load_all=True, sort=False, limit=None):
+    """Generate a list of words to review
+
+    With sort, the most overdue words of every category come first. limit
+    caps the number of words in the whole list."""
+    invariants = load_stats('invariant')
+    nominals = load_stats('nominal')
+    verbs = load_stats('verb')
     now = pd.to_datetime(datetime.datetime.now())
-    invariants_to_review = [[word, 'invariant'] for
-                            word in list(invariants.index) if
-                            now > invariants.loc[word, 'Next review']]
-    nominals_to_review = [[word, 'nominal'] for
-                          word in list(nominals.index) if
-                          now > nominals.loc[word, 'Next review']]
-    verbs_to_review = [[word, 'verb'] for
-                       word in list(verbs.index) if
-                       now > verbs.loc[word, 'Next review']]
-    words = invariants_to_review + nominals_to_review + verbs_to_review
+    due = []
+    for cat, words_df in [('invariant', invariants), ('nominal', nominals),
+                          ('verb', verbs)]:
+        # No category can give more than limit words to the merged list
+        keys = select_due(words_df, cat, now, sort, limit)
+        due.append(pd.DataFrame({
+                'Key': pd.Series(keys, dtype=object),
+                'Category': cat,
+                'Next review': date_values(words_df.loc[keys,
+                                                        'Next review'])}))
+    due = pd.concat(due, ignore_index=True)
+    if sort:
+        due = due.sort_values('Next review', kind='stable')
+    if limit is not None:
+        due = due.head(limit)
+    words = [[key, cat] for key, cat in zip(due['Key'], due['Category'])]
     if load_all:
         return words, invariants, nominals, verbs
     else:
         return words
     
-def generate_phrases_list():
+def generate_phrases_list(sort=False, limit=None):
     """Generate a list of phrases to review"""
-    phrases = load_phrases()
+    phrases = load_stats('phrase')
     now = pd.to_datetime(datetime.datetime.now())
-    phrases_to_review = [phrase_i for phrase_i in list(phrases.index) if
-                            now > phrases.loc[phrase_i, 'Next review']]
+    phrases_to_review = select_due(phrases, 'phrase', now, sort,
+                                   limit).tolist()
     return phrases_to_review
 
+@timed('answer')
 def process_correct(word, words_df, cat):
     """Process a correct answer"""
     print("Correct")
-    words_df.loc[word, 'Last reviewed'] = pd.to_datetime(datetime
-                  .datetime.now())
+    now = pd.to_datetime(datetime.datetime.now())
+    interval = pd.to_timedelta(words_df.loc[word, 'Interval'])
     # Do not increase the interval if the word was previously incorrect
     if words_df.loc[word, 'Correct?']:
-        words_df.loc[word, 'Interval'] = (pd.to_timedelta(words_df.loc[word, 
-                    'Interval']) * CORRECT_INTERVAL)
+        interval = interval * CORRECT_INTERVAL
         # Make sure the interval doesn't exceed the max
-        if pd.to_timedelta(words_df.loc[word, 'Interval']) > MAXIMUM_INTERVAL:
-            words_df.loc[word, 'Interval'] = MAXIMUM_INTERVAL
-    words_df.loc[word, 'Next review'] = (
-            pd.to_datetime(datetime.datetime.now() + 
-                           pd.to_timedelta(words_df.loc[word, 'Interval'])))
-    print("Next review: {}".format(words_df.loc[word, 'Next review']))
-    words_df.loc[word, 'Correct?'] = True
-    words_df.loc[word, 'Times correct'] += 1
-    if cat == 'invariant':
-        words_df.to_csv('invariants.csv')
-    elif cat == 'nominal':
-        words_df.to_csv('nominals.csv')
-    elif cat == 'verb':
-        words_df.to_csv('verbs.csv')
-    elif cat == 'phrase':
-        words_df.to_csv('phrases.csv')
+        if interval > MAXIMUM_INTERVAL:
+            interval = MAXIMUM_INTERVAL
+    if LOAD_BALANCE:
+        next_review = balance_review(cat, now, interval)
+    else:
+        next_review = now + interval
+    print("Next review: {}".format(next_review))
+    deck = get_deck()
+    if cat in deck.due_days and words_df is deck.tables.get(cat):
+        deck.due_days[cat].move(words_df.loc[word, 'Next review'],
+                                next_review)
+    # The row changes in one step, so a background write never takes half
+    # of an answer
+    with deck.lock:
+        words_df.loc[word, 'Last reviewed'] = now
+        words_df.loc[word, 'Interval'] = interval
+        words_df.loc[word, 'Next review'] = next_review
+        words_df.loc[word, 'Correct?'] = True
+        words_df.loc[word, 'Times correct'] += 1
+    save_review(word, words_df, cat, correct=True)
     return True
 
+@timed('answer')
 def process_incorrect(word, words_df, cat):
     """Process an incorrect answer"""
     if cat == 'invariant' or cat == 'nominal':
-        print("Incorrect. {} is {}".format(words_df.loc[word,
-              'English'], word))
+        print("Incorrect. {} is {}".format(card_value(words_df, cat, word,
+              'English'), word))
     elif cat == 'verb':
-        print("Incorrect. {} is {}".format(words_df.loc[word,
-              'English present'], word))
+        print("Incorrect. {} is {}".format(card_value(words_df, cat, word,
+              'English present'), word))
     elif cat == 'phrase':
-        print("Incorrect. {}\nis\n{}".format(words_df.loc[word, 'English'],
-              words_df.loc[word, 'Finnish']))
-    words_df.loc[word, 'Last reviewed'] = pd.to_datetime(datetime
-                  .datetime.now())
-    if (pd.to_timedelta(words_df.loc[word, 'Interval']) > 
-        pd.to_timedelta('1 days')):
-        words_df.loc[word, 'Interval'] = (pd.to_timedelta(words_df.loc[word, 
-                    'Interval']) * INCORRECT_INTERVAL)
+        print("Incorrect. {}\nis\n{}".format(
+              card_value(words_df, cat, word, 'English'),
+              card_value(words_df, cat, word, 'Finnish')))
+    now = pd.to_datetime(datetime.datetime.now())
+    interval = pd.to_timedelta(words_df.loc[word, 'Interval'])
+    if interval > pd.to_timedelta('1 days'):
+        interval = interval * INCORRECT_INTERVAL
         # Make sure interval is not less than the minimum
-        if pd.to_timedelta(words_df.loc[word, 'Interval']) < MINIMUM_INTERVAL:
-            words_df.loc[word, 'Interval'] = MINIMUM_INTERVAL
+        if interval < MINIMUM_INTERVAL:
+            interval = MINIMUM_INTERVAL
         # Make sure interval is not greater than the maximum after wrong
-        if pd.to_timedelta(words_df.loc[word, 'Interval']) > MAX_AFTER_WRONG:
-            words_df.loc[word, 'Interval'] = MAX_AFTER_WRONG
-    words_df.loc[word, 'Correct?'] = False
-    words_df.loc[word, 'Times incorrect'] += 1
-    if cat == 'invariant':
-        words_df.to_csv('invariants.csv')
-    elif cat == 'nominal':
-        words_df.to_csv('nominals.csv')
-    elif cat == 'verb':
-        words_df.to_csv('verbs.csv')
-    elif cat == 'phrase':
-        words_df.to_csv('phrases.csv')
+        if interval > MAX_AFTER_WRONG:
+            interval = MAX_AFTER_WRONG
+    with get_deck().lock:
+        words_df.loc[word, 'Last reviewed'] = now
+        words_df.loc[word, 'Interval'] = interval
+        words_df.loc[word, 'Correct?'] = False
+        words_df.loc[word, 'Times incorrect'] += 1
+    save_review(word, words_df, cat, correct=False)
     return True
         
+def correct_intervals(intervals, was_correct, rate=None):
+    """Apply the interval rules for a correct answer to an array
+
+    rate defaults to CORRECT_INTERVAL."""
+    if rate is None:
+        rate = CORRECT_INTERVAL
+    # Do not increase the interval if the word was previously incorrect
+    increased = np.minimum(intervals * rate,
+                           MAXIMUM_INTERVAL.to_timedelta64())
+    return np.where(was_correct, increased, intervals)
+
+def incorrect_intervals(intervals, rate=None, max_after_wrong=None):
+    """Apply the interval rules for an incorrect answer to an array
+
+    rate and max_after_wrong default to INCORRECT_INTERVAL and
+    MAX_AFTER_WRONG."""
+    if rate is None:
+        rate = INCORRECT_INTERVAL
+    if max_after_wrong is None:
+        max_after_wrong = MAX_AFTER_WRONG
+    decreased = np.clip(intervals * rate,
+                        MINIMUM_INTERVAL.to_timedelta64(),
+                        pd.to_timedelta(max_after_wrong).to_timedelta64())
+    return np.where(intervals > np.timedelta64(1, 'D'), decreased, intervals)
+
+def process_reviews(keys, correct, timestamps, words_df, cat, save=True):
+    """Process a batch of answers
+
+    keys, correct and timestamps are parallel arrays. Answers for the same
+    card are applied in order, giving the same result as calling
+    process_correct and process_incorrect for each answer in turn."""
+    keys = pd.Index(keys)
+    correct = np.asarray(correct, dtype=bool)
+    timestamps = pd.to_datetime(timestamps).values
+    positions = words_df.index.get_indexer(keys)
+    missing = positions < 0
+    if missing.any():
+        print("No entry for {}".format(", ".join(map(str, keys[missing]))))
+        positions = positions[~missing]
+        correct = correct[~missing]
+        timestamps = timestamps[~missing]
+    if len(positions) == 0:
+        return None
+    last_reviewed = date_values(words_df['Last reviewed']).copy()
+    old_next_review = date_values(words_df['Next review'])
+    next_review = old_next_review.copy()
+    interval = pd.to_timedelta(words_df['Interval']).values.copy()
+    was_correct = words_df['Correct?'].values.astype(bool)
+    times_correct = words_df['Times correct'].values.copy()
+    times_incorrect = words_df['Times incorrect'].values.copy()
+    # Each round takes the next answer for every card that has one left
+    rounds = pd.Series(positions).groupby(positions).cumcount().values
+    for i in range(rounds.max() + 1):
+        in_round = rounds == i
+        pos = positions[in_round]
+        right = correct[in_round]
+        now = timestamps[in_round]
+        last_reviewed[pos] = now
+        interval[pos] = np.where(right,
+                                 correct_intervals(interval[pos],
+                                                   was_correct[pos]),
+                                 incorrect_intervals(interval[pos]))
+        next_review[pos] = np.where(right, now + interval[pos],
+                                    next_review[pos])
+        was_correct[pos] = right
+        times_correct[pos] += right
+        times_incorrect[pos] += ~right
+    if (current_deck is not None and cat in current_deck.due_days and
+        words_df is current_deck.tables.get(cat)):
+        reviewed = np.unique(positions)
+        current_deck.due_days[cat].remove(old_next_review[reviewed])
+        current_deck.due_days[cat].add(next_review[reviewed])
+    with get_deck().lock:
+        words_df['Last reviewed'] = last_reviewed
+        words_df['Next review'] = next_review
+        words_df['Interval'] = interval
+        words_df['Correct?'] = was_correct
+        words_df['Times correct'] = times_correct
+        words_df['Times incorrect'] = times_incorrect
+    if words_df is get_deck().tables.get(cat):
+        # The reviews aren't noted as changes, so the last written copy
+        # can't be brought up to date from them
+        with get_deck().write_lock:
+            get_deck().written.pop(cat, None)
+    if save:
+        save_table(words_df, cat, stats_only=True)
+    return True
+
+def import_reviews(path):
+    """Apply a review log in journal format, e.g. from another device"""
+    reviews = pd.read_csv(path,
+                          dtype={'Key': str},
+                          keep_default_na=False,
+                          parse_dates=['Timestamp'])
+    for cat, cat_reviews in reviews.groupby('Category', sort=False):
+        words_df = load_stats(cat)
+        keys = cat_reviews['Key']
+        if pd.api.types.is_integer_dtype(words_df.index):
+            keys = keys.astype(int)
+        process_reviews(keys, cat_reviews['Correct?'],
+                        cat_reviews['Timestamp'], words_df, cat)
+    print("Imported {} reviews".format(len(reviews)))
+    return True
+
+def recall_chances(recall, elapsed, interval, cards):
+    """The chance of a correct answer for each card being reviewed"""
+    if callable(recall):
+        chances = recall(elapsed, interval, cards)
+    elif np.ndim(recall) == 0:
+        return np.full(len(cards), float(recall))
+    else:
+        chances = np.asarray(recall, dtype=float)[cards]
+    return np.broadcast_to(np.asarray(chances, dtype=float), len(cards))
+
+def forgetting_curve(at_interval=0.9):
+    """Recall that decays exponentially, reaching at_interval when due
+
+    For use as the recall argument of simulate_reviews."""
+    decay = np.log(at_interval)
+    def recall(elapsed, interval, cards):
+        return np.exp(decay * elapsed / np.maximum(interval, 1 / 24))
+    return recall
+
+def simulate_reviews(cards, days=365, trials=1, recall=0.9, seed=None,
+                     correct_interval=None, incorrect_interval=None,
+                     max_after_wrong=None, further_testing_rate=None,
+                     further_testing=False, max_retries=20):
+    """Simulate a daily session over a deck for a number of days
+
+    cards is a number of new cards or a stats table such as
+    load_stats('verb'). recall is the chance of a correct answer: a number,
+    an array with one value per card, or a function of the days since the
+    last review, the interval in days and the card positions, such as
+    forgetting_curve(). Every trial runs over all of the cards at once with
+    the same rules as process_correct and process_incorrect, and a failed
+    card is asked again in the same session until it is answered or has
+    failed max_retries times. Forms are tested after a correct answer once
+    in further_testing_rate times, or always if further_testing is set,
+    and after every incorrect answer.
+
+    The interval settings default to the module settings. Returns the mean
+    over the trials of each day's reviews, retries, form drills and
+    retention, the share of due cards answered correctly the first time."""
+    if further_testing_rate is None:
+        further_testing_rate = FURTHER_TESTING_RATE
+    rng = np.random.default_rng(seed)
+    day = np.timedelta64(1, 'D')
+    if isinstance(cards, pd.DataFrame):
+        start = pd.to_datetime(datetime.datetime.now()).to_datetime64()
+        n_cards = len(cards)
+        interval = np.tile(pd.to_timedelta(cards['Interval']).values, trials)
+        next_review = np.tile(date_values(cards['Next review']) - start,
+                              trials)
+        last_reviewed = np.tile(date_values(cards['Last reviewed']) - start,
+                                trials)
+        was_correct = np.tile(cards['Correct?'].values.astype(bool), trials)
+    else:
+        n_cards = int(cards)
+        size = n_cards * trials
+        interval = np.full(size, np.timedelta64(1, 'D'), dtype='m8[ns]')
+        next_review = np.zeros(size, dtype='m8[ns]')
+        last_reviewed = np.zeros(size, dtype='m8[ns]')
+        was_correct = np.ones(size, dtype=bool)
+    reviews = np.zeros((trials, days))
+    retries = np.zeros((trials, days))
+    drills = np.zeros((trials, days))
+    remembered = np.zeros((trials, days))
+    for i in range(days):
+        now = i * day
+        due = np.flatnonzero(next_review <= now)
+        trial = due // n_cards
+        elapsed = (now - last_reviewed[due]) / day
+        chances = recall_chances(recall, elapsed, interval[due] / day,
+                                 due % n_cards)
+        right = rng.random(len(due)) < chances
+        reviews[:, i] = np.bincount(trial, minlength=trials)
+        remembered[:, i] = np.bincount(trial[right], minlength=trials)
+        attempt = 0
+        while len(due):
+            last_reviewed[due] = now
+            answered = due[right]
+            interval[answered] = correct_intervals(interval[answered],
+                                                   was_correct[answered],
+                                                   correct_interval)
+            next_review[answered] = now + interval[answered]
+            was_correct[answered] = True
+            failed = due[~right]
+            interval[failed] = incorrect_intervals(interval[failed],
+                                                   incorrect_interval,
+                                                   max_after_wrong)
+            was_correct[failed] = False
+            # Forms are drilled after misses and some of the correct answers
+            if further_testing:
+                drilled = np.ones(len(due), dtype=bool)
+            else:
+                drilled = ~right | (rng.integers(1, further_testing_rate + 1,
+                                                 len(due)) == 1)
+            drills[:, i] += np.bincount(due[drilled] // n_cards,
+                                        minlength=trials)
+            attempt += 1
+            if attempt > max_retries:
+                break
+            due = failed
+            retries[:, i] += np.bincount(due // n_cards, minlength=trials)
+            chances = recall_chances(recall, np.zeros(len(due)),
+                                     interval[due] / day, due % n_cards)
+            right = rng.random(len(due)) < chances
+    with np.errstate(invalid='ignore', divide='ignore'):
+        retention = remembered.sum(axis=0) / reviews.sum(axis=0)
+    return pd.DataFrame({'Reviews': reviews.mean(axis=0),
+                         'Retries': retries.mean(axis=0),
+                         'Form drills': drills.mean(axis=0),
+                         'Retention': retention},
+                        index=pd.RangeIndex(days, name='Day'))
+
 def flash_invariant(word, invariants):
     """Do an invariant flashcard"""
-    english_list = invariants.loc[word, 'English'].split(', ')
-    english = random.choice(english_list)
-    print(english)
+    with phase('prompt'):
+        english_list = card_value(invariants, 'invariant', word,
+                                  'English').split(', ')
+        english = random.choice(english_list)
+        print(english)
     answer = input("Soumeksi: ").lower()
     if answer == '#q':
         return False
@@ -774,9 +3259,11 @@ def flash_invariant(word, invariants):
 
 def flash_nominal(word, nominals):
     """Do a nominal flashcard"""
-    english_list = nominals.loc[word, 'English'].split(', ')
-    english = random.choice(english_list)
-    print(english)
+    with phase('prompt'):
+        english_list = card_value(nominals, 'nominal', word,
+                                  'English').split(', ')
+        english = random.choice(english_list)
+        print(english)
     answer = input("Suomeksi: ").lower()
     if answer == '#q':
         return False
@@ -790,8 +3277,9 @@ def flash_nominal(word, nominals):
         'nominals' not in FURTHER_TESTING and
         random.randint(1, FURTHER_TESTING_RATE) > 1):
         return True
-    form_name = random.choice(list(NOMINAL_FORMS.keys()))
-    form_value = nominals.loc[word, form_name]
+    with phase('prompt'):
+        form_name = pick_form('nominal', word, list(NOMINAL_FORMS.keys()))
+        form_value = word_form(nominals, 'nominal', word, form_name)
     answer = input("{}: ".format(form_name)).lower()
     if answer == '#q':
         return False
@@ -799,6 +3287,7 @@ def flash_nominal(word, nominals):
         print("Correct")
     else:
         print("Incorrect. {} of {} is {}".format(form_name, word, form_value))
+    review_form('nominal', word, form_name, answer == form_value)
     return True
 
 def tps_conjugation(english):
@@ -815,11 +3304,105 @@ def tps_conjugation(english):
     english += 's'
     return english
         
+def compile_verb_prompts(verb_row):
+    """Build the quiz prompt for every quizzable form of a verb
+
+    Returns a tuple of (form name, Finnish answer, English prompt)"""
+    present = verb_row['English present']
+    # English form key:
+    # 0: Simple present / present participle
+    # 1: Simple present only
+    # 2: Simple past
+    # 3: Past participle
+    # 4: Present participle only
+    english_forms = {
+            1: present,
+            2: verb_row['English simple past'],
+            3: verb_row['English past participle'],
+            4: verb_row['English present participle']
+            }
+    prompts = []
+    for form_name in QUIZ_VERB_FORMS:
+        subjects, english_form = VERB_FORMS[form_name]
+        if english_form == 0:
+            verb_phrase_subjects = subjects.split(" / ")
+            if form_name == 'Third person' or form_name == 'Passive':
+                conjugation = tps_conjugation(present)
+            else:
+                conjugation = present
+            if len(verb_phrase_subjects) == 2:
+                english_verb_phrase = "{} - \"{} {} / {} {}\"".format(
+                        form_name, verb_phrase_subjects[0], conjugation,
+                        verb_phrase_subjects[1], english_forms[4])
+            elif len(verb_phrase_subjects) == 1:
+                english_verb_phrase = "{} - \"{} {}\"".format(
+                        form_name, verb_phrase_subjects[0], conjugation)
+            else:
+                print("{} has an improper English verb structure!"
+                      .format(form_name))
+                continue
+        elif english_form in english_forms:
+            english_verb_phrase = "{} - \"{} {}\"".format(
+                    form_name, subjects, english_forms[english_form])
+        else:
+            print("{} does not have a proper verb form assignment!"
+                  .format(form_name))
+            continue
+        prompts.append((form_name, verb_row[form_name], english_verb_phrase))
+    return tuple(prompts)
+
+def card_value(words_df, cat, key, column):
+    """One column of a card, from the deck's content when words_df only has
+    the stats"""
+    if column in words_df.columns:
+        return words_df.loc[key, column]
+    return get_deck().content(cat).loc[key, column]
+
+def word_form(words_df, cat, word, form_name):
+    """One form of a word, from the session's deck when words_df is its"""
+    deck = get_deck()
+    if words_df is deck.tables.get(cat):
+        return deck.form(cat, word, form_name)
+    return words_df.loc[word, form_name]
+
+def pick_form(cat, word, form_names, now=None):
+    """Choose a form of a word to drill
+
+    Drilled forms that are due come first, then forms not drilled yet,
+    and any of them if none of those are left"""
+    stats = get_deck().drills(cat)
+    due = stats.due(now, words=[word])
+    due = [form for form in due['Form'] if form in form_names]
+    if due:
+        return due[0]
+    seen = set(stats.seen(word))
+    unseen = [form for form in form_names if form not in seen]
+    return random.choice(unseen if unseen else list(form_names))
+
+def review_form(cat, word, form_name, correct):
+    """Record a form drill answer"""
+    deck = get_deck()
+    with deck.lock:
+        deck.drills(cat).review(word, form_name, correct)
+    deck.changed()
+
+def verb_prompts(verb, verbs):
+    """The quiz prompts of a verb, compiled once per session for the deck
+
+    verbs without the forms, like the stats kept apart with SPLIT_STATS,
+    get them from the deck"""
+    deck = get_deck()
+    if (verbs is deck.tables.get('verb') or
+        FORM_COLUMNS['verb'][0] not in verbs.columns):
+        return deck.prompts(verb)
+    return deck.prompts(verb, verbs.loc[verb])
+
 def flash_verb(word, verbs, form_only=False):
     """Do a verb flashcard"""
     if not form_only:
-        english = verbs.loc[word, 'English present']
-        print("To {}".format(english))
+        with phase('prompt'):
+            english = card_value(verbs, 'verb', word, 'English present')
+            print("To {}".format(english))
         answer = input("Soumeksi: ").lower()
         if answer == 'q':
             return False
@@ -833,59 +3416,11 @@ def flash_verb(word, verbs, form_only=False):
             'verbs' not in FURTHER_TESTING and
             random.randint(1, FURTHER_TESTING_RATE) > 1):
             return True
-    form_choices = [form for form in VERB_FORMS.keys() if 
-                    VERB_FORMS[form] != "[skip]"]
-    form_name = random.choice(form_choices)
-    while VERB_FORMS[form_name][0] == '[skip]':
-        form_name = random.choice(form_choices)
-    form_value = verbs.loc[word, form_name]
-    # English form key:
-    # 0: Simple present / present participle
-    # 1: Simple present only
-    # 2: Simple past
-    # 3: Past participle
-    # 4: Present participle only
-    if VERB_FORMS[form_name][1] == 0:
-        verb_phrase_subjects = VERB_FORMS[form_name][0].split(" / ")
-        if form_name == 'Third person' or form_name == 'Passive':
-            conjugation = tps_conjugation(verbs.loc[word, 'English present'])
-        else:
-            conjugation = verbs.loc[word, 'English present']
-        if len(verb_phrase_subjects) == 2:
-            english_verb_phrase = "{} - \"{} {} / {} {}\"".format(form_name,
-                                   verb_phrase_subjects[0],
-                                   conjugation,
-                                   verb_phrase_subjects[1],
-                                   verbs.loc[word,
-                                             'English present participle'])
-        elif len(verb_phrase_subjects) == 1:
-            english_verb_phrase = "{} - \"{} {}\"".format(form_name,
-                                   verb_phrase_subjects[0],
-                                   conjugation)
-        else:
-            print("{} has an improper English verb structure!"
-                  .format(form_name))
-            return False
-    elif VERB_FORMS[form_name][1] == 1:
-        english_verb_phrase = "{} - \"{} {}\"".format(form_name,
-                               VERB_FORMS[form_name][0],
-                               verbs.loc[word, 'English present'])
-    elif VERB_FORMS[form_name][1] == 2:
-        english_verb_phrase = "{} - \"{} {}\"".format(form_name,
-                               VERB_FORMS[form_name][0],
-                               verbs.loc[word, 'English simple past'])
-    elif VERB_FORMS[form_name][1] == 3:
-        english_verb_phrase = "{} - \"{} {}\"".format(form_name,
-                               VERB_FORMS[form_name][0],
-                               verbs.loc[word, 'English past participle'])
-    elif VERB_FORMS[form_name][1] == 4:
-        english_verb_phrase = "{} - \"{} {}\"".format(form_name,
-                               VERB_FORMS[form_name][0],
-                               verbs.loc[word, 'English present participle'])
-    else:
-        print("{} does not have a proper verb form assignment!"
-              .format(form_name))
-        return False
+    with phase('prompt'):
+        prompts = {prompt[0]: prompt for prompt in
+                   verb_prompts(word, verbs)}
+        form_name, form_value, english_verb_phrase = prompts[
+                pick_form('verb', word, list(prompts))]
     answer = input("{}: ".format(english_verb_phrase)).lower()
     if answer == '#q':
         return False
@@ -894,54 +3429,116 @@ def flash_verb(word, verbs, form_only=False):
     else:
         print("Incorect. {} of {} is {}".format(form_name, word,
               form_value))
+    review_form('verb', word, form_name, answer == form_value)
     return True
 
 def flash_phrase(phrase_i, phrases):
     """Do a phrase flashcard"""
-    english = phrases.loc[phrase_i, 'English']
-    print(english)
+    with phase('prompt'):
+        english = card_value(phrases, 'phrase', phrase_i, 'English')
+        print(english)
     answer = input("Soumeksi: ").lower()
     if answer == '#q':
         return False
-    if answer == phrases.loc[phrase_i, 'Finnish']:
+    if answer == card_value(phrases, 'phrase', phrase_i, 'Finnish'):
         process_correct(phrase_i, phrases, cat='phrase')
     else:
         process_incorrect(phrase_i, phrases, cat='phrase')
     return True
 
-def flashcards():
-    """The core flashcards function"""
+def session_cards(words, tables, max_new=None, max_due=None):
+    """The due words of a session as (key, category, next review), leaving
+    out the latest reviews past max_new new cards and max_due others"""
+    if max_new is None:
+        max_new = MAX_NEW_CARDS
+    if max_due is None:
+        max_due = MAX_DUE_CARDS
+    cards = []
+    for cat, words_df in tables.items():
+        keys = [key for key, word_cat in words if word_cat == cat]
+        rows = words_df.loc[keys]
+        next_review = date_values(rows['Next review']).astype(np.int64)
+        new = ((rows['Times correct'] + rows['Times incorrect']) == 0).values
+        cards += zip(keys, [cat] * len(keys), next_review, new)
+    cards.sort(key=lambda card: card[2])
+    new_cards = [card[:3] for card in cards if card[3]][:max_new]
+    due_cards = [card[:3] for card in cards if not card[3]][:max_due]
+    return sorted(new_cards + due_cards, key=lambda card: card[2])
+
+class SessionQueue:
+    """The cards left in a session, in a heap by the position each is next
+    shown at"""
+
+    def __init__(self, cards, interleave=False):
+        """cards are (key, category, next review), shown longest due first
+        and at random between cards due at the same time. With interleave,
+        the categories take turns"""
+        self.heap = []
+        self.position = 0
+        self.pushed = 0
+        cards = sorted(cards, key=lambda card: (card[2], random.random()))
+        if interleave:
+            cats = list(dict.fromkeys(cat for _, cat, _ in cards))
+            ranks = dict.fromkeys(cats, 0)
+            turns = []
+            for key, cat, _ in cards:
+                turns.append((ranks[cat], cats.index(cat)))
+                ranks[cat] += 1
+            cards = [card for _, card in sorted(zip(turns, cards),
+                                                key=lambda turn: turn[0])]
+        for position, (key, cat, _) in enumerate(cards):
+            self.push(position, key, cat)
+
+    def __len__(self):
+        return len(self.heap)
+
+    def push(self, position, key, cat):
+        """Add a card to show at a position, after any already there"""
+        heapq.heappush(self.heap, (position, self.pushed, key, cat))
+        self.pushed += 1
+
+    def pop(self):
+        """The next card to show as (key, category)"""
+        self.position, _, key, cat = heapq.heappop(self.heap)
+        return key, cat
+
+    def requeue(self, key, cat, gap=None):
+        """Show a card again after gap more cards, or at the end if fewer
+        are left"""
+        if gap is None:
+            gap = REQUEUE_GAP
+        self.push(self.position + gap, key, cat)
+
+@timed('flashcards')
+def flashcards(max_new=None, max_due=None, interleave=None):
+    """The core flashcards function
+
+    Failed cards come back a few cards later until they are answered.
+    max_new, max_due and interleave default to MAX_NEW_CARDS, MAX_DUE_CARDS
+    and INTERLEAVE_CATEGORIES."""
+    if interleave is None:
+        interleave = INTERLEAVE_CATEGORIES
     words, invariants, nominals, verbs = generate_words_list()
-    while True:
-        print("{} words due".format(len(words)))
-        random.shuffle(words)
-        for word in words:
-            if word[1] == 'invariant':
-                if not flash_invariant(word[0], invariants):
-                    print("Quitting")
-                    return None
-            elif word[1] == 'nominal':
-                if not flash_nominal(word[0], nominals):
-                    print("Quitting")
-                    return None
-            elif word[1] == 'verb':
-                if not flash_verb(word[0], verbs):
-                    print("Quitting")
-                    return None
-        words, invariants, nominals, verbs = generate_words_list()
-        # Keep going if there are still wrong words
-        correct_list = (invariants['Correct?'] + nominals['Correct?'] +
-                        verbs['Correct?'])
-        if not all(correct_list):
-            continue
-        else:
-            break
+    tables = {'invariant': invariants, 'nominal': nominals, 'verb': verbs}
+    flash = {'invariant': flash_invariant, 'nominal': flash_nominal,
+             'verb': flash_verb}
+    queue = SessionQueue(session_cards(words, tables, max_new, max_due),
+                         interleave)
+    print("{} words due".format(len(queue)))
+    while queue:
+        word, cat = queue.pop()
+        if not flash[cat](word, tables[cat]):
+            print("Quitting")
+            return None
+        if not tables[cat].loc[word, 'Correct?']:
+            queue.requeue(word, cat)
     print("No more flashcards")
     
+@timed('phrasecards')
 def phrasecards():
     """Flashcards for phrases"""
     phrase_indices = generate_phrases_list()
-    phrases = load_phrases()
+    phrases = load_stats('phrase')
     random.shuffle(phrase_indices)
     for phrase_i in phrase_indices:
         if not flash_phrase(phrase_i, phrases):
@@ -963,4 +3560,485 @@ def verb_forms_quiz(verb=None):
             save_verb(verb=verb)
             verbs = load_verbs()
     while flash_verb(verb, verbs, form_only=True):
-        continue
\ No newline at end of file
+        continue
+
+def add_card(cat, finnish, english, forms=None):
+    """Add a card to a category without prompting
+
+    english is a list of the four English forms for verbs. Nominals and
+    verbs without forms have them looked up. Returns the card's key, or
+    None when it can't be added."""
+    words_df = get_deck().table(cat)
+    if cat == 'phrase':
+        key = words_df.index.max() + 1 if len(words_df) else 0
+        entry = pd.DataFrame(data=[[finnish, english] + new_stats()],
+                             columns=PHRASE_COLUMNS + STATS, index=[key])
+    else:
+        if finnish in words_df.index:
+            print("{} already in file".format(finnish))
+            return None
+        if cat == 'verb' and len(english) != 4:
+            print("Wrong number of entries in English list")
+            return None
+        if cat in FORM_COLUMNS and forms is None:
+            forms = lookup_forms(finnish, cat)
+            if not forms:
+                return None
+        if cat == 'invariant':
+            data = [finnish, english, "", ""]
+            columns = INVARIANT_COLUMNS
+        elif cat == 'nominal':
+            data = [finnish, english] + list(forms)
+            columns = NOMINAL_COLUMNS + FORM_COLUMNS[cat]
+        elif cat == 'verb':
+            data = [finnish] + list(english) + list(forms)
+            columns = VERB_COLUMNS + FORM_COLUMNS[cat]
+        entry = pd.DataFrame(data=[data + new_stats()],
+                             columns=columns + STATS)
+        entry.set_index(keys=columns[0], inplace=True)
+        key = finnish
+    words_df = pd.concat([words_df, entry], verify_integrity=True)
+    save_rows(words_df, [key], cat, new=True)
+    return key
+
+def card_prompt(cat, key):
+    """What a card shows"""
+    words_df = get_deck().content(cat)
+    if cat == 'verb':
+        return "To {}".format(words_df.loc[key, 'English present'])
+    return words_df.loc[key, 'English']
+
+def card_answer(cat, key):
+    """What a card expects as the answer"""
+    if cat == 'phrase':
+        return get_deck().content(cat).loc[key, 'Finnish']
+    return key
+
+class Learner:
+    """One learner's review stats over the session's deck
+
+    The deck holds the cards, which every learner shares. A learner only
+    has the STATS columns of each category, saved to their own file in
+    directory, LEARNERS_DIR by default. Cards the learner hasn't seen start
+    with new stats."""
+
+    def __init__(self, name, directory=None):
+        self.name = name
+        self.directory = LEARNERS_DIR if directory is None else directory
+        self.path = os.path.join(self.directory, "{}.csv".format(name))
+        self.tables = {}
+        self.dirty = False
+        # Made by the review service, so saves don't interleave
+        self.lock = None
+        if os.path.exists(self.path):
+            rows = pd.read_csv(self.path,
+                               dtype={'Key': str},
+                               keep_default_na=False,
+                               parse_dates=['Last reviewed', 'Next review'])
+            rows['Interval'] = pd.to_timedelta(rows['Interval'])
+            rows['Correct?'] = rows['Correct?'].astype(bool)
+            for cat, cat_rows in rows.groupby('Category'):
+                cat_rows = cat_rows.set_index('Key')[STATS]
+                if cat == 'phrase':
+                    cat_rows.index = cat_rows.index.astype(int)
+                self.tables[cat] = cat_rows
+
+    def stats(self, cat):
+        """The learner's stats for a category, covering every card in it"""
+        cards = get_deck().stats(cat).index
+        words_df = self.tables.get(cat)
+        # Kept in the deck's order, so a table that covers the deck's cards
+        # is quick to tell
+        if words_df is None or not words_df.index.equals(cards):
+            missing = (cards if words_df is None else
+                       cards.difference(words_df.index))
+            entries = pd.DataFrame(data=[new_stats()] * len(missing),
+                                   columns=STATS, index=missing)
+            if words_df is not None:
+                entries = pd.concat([words_df[words_df.index.isin(cards)],
+                                     entries])
+            words_df = entries.reindex(cards).astype({'Correct?': bool,
+                                       'Times correct': np.int64,
+                                       'Times incorrect': np.int64})
+            self.tables[cat] = words_df
+        return words_df
+
+    def next_card(self, now=None):
+        """The learner's most overdue card, as (category, key), or None"""
+        tables = {cat: self.stats(cat) for cat in DATA_FILES}
+        if now is None:
+            now = pd.to_datetime(datetime.datetime.now())
+        best = None
+        for cat, words_df in tables.items():
+            due = due_cards(words_df, now, sort=True, limit=1)
+            if len(due):
+                next_review = words_df.loc[due[0], 'Next review']
+                if best is None or next_review < best[0]:
+                    best = (next_review, cat, due[0])
+        return None if best is None else best[1:]
+
+    def answer(self, cat, key, correct, now=None):
+        """Apply an answer with the usual interval rules, returning the
+        card's next review"""
+        if now is None:
+            now = pd.to_datetime(datetime.datetime.now())
+        words_df = self.stats(cat)
+        process_reviews([key], [correct], [now], words_df, cat, save=False)
+        self.dirty = True
+        return words_df.loc[key, 'Next review']
+
+    def snapshot(self):
+        """The learner's stats as rows for their file"""
+        frames = []
+        for cat, words_df in self.tables.items():
+            frame = words_df.copy()
+            frame.insert(0, 'Key', frame.index)
+            frame.insert(0, 'Category', cat)
+            frames.append(frame)
+        self.dirty = False
+        return pd.concat(frames) if frames else pd.DataFrame(
+                columns=['Category', 'Key'] + STATS)
+
+    def write(self, rows):
+        """Write rows from snapshot to the learner's file, replacing it in
+        one step so a reader never sees half a file"""
+        os.makedirs(self.directory, exist_ok=True)
+        with replacing(self.path) as temp_path:
+            rows.to_csv(temp_path, index=False)
+
+class ReviewService:
+    """A local HTTP service for several learners drilling the same deck
+
+    GET  /next?learner=NAME           the learner's most overdue card
+    POST /answer                      {learner, category, key, answer}
+    POST /words                       {category, finnish, english, forms}
+    GET  /phrases?q=SEARCH&limit=N    phrases matching a search
+
+    The cards are loaded once and shared. Each learner's stats are kept
+    in memory and saved every LEARNER_SAVE_INTERVAL seconds and on close,
+    one save at a time per learner, to learners_dir or LEARNERS_DIR."""
+
+    def __init__(self, host=None, port=None, learners_dir=None):
+        self.host = SERVICE_HOST if host is None else host
+        self.port = SERVICE_PORT if port is None else port
+        self.learners_dir = learners_dir
+        self.learners = {}
+        self.server = None
+        self.saver = None
+
+    def learner(self, name):
+        """A learner by name, loaded on first use"""
+        import asyncio
+        if not name or not re.fullmatch(r'[\w-]+', name):
+            raise ValueError("Bad learner name: {}".format(name))
+        if name not in self.learners:
+            learner = Learner(name, self.learners_dir)
+            learner.lock = asyncio.Lock()
+            self.learners[name] = learner
+        return self.learners[name]
+
+    async def start(self):
+        """Load the deck and start listening"""
+        import asyncio
+        deck = get_deck()
+        for cat in DATA_FILES:
+            deck.content(cat)
+        self.server = await asyncio.start_server(self.handle, self.host,
+                                                 self.port)
+        self.port = self.server.sockets[0].getsockname()[1]
+        self.saver = asyncio.ensure_future(self.save_periodically())
+        print("Serving on {}:{}".format(self.host, self.port))
+
+    async def close(self):
+        """Stop listening and save every learner"""
+        self.saver.cancel()
+        self.server.close()
+        await self.server.wait_closed()
+        await self.save_learners(everyone=True)
+
+    async def save_learners(self, everyone=False):
+        """Save the learners with unsaved answers"""
+        import asyncio
+        loop = asyncio.get_running_loop()
+        for learner in list(self.learners.values()):
+            if not (learner.dirty or everyone):
+                continue
+            async with learner.lock:
+                rows = learner.snapshot()
+                await loop.run_in_executor(None, learner.write, rows)
+
+    async def save_periodically(self):
+        """Save the learners every LEARNER_SAVE_INTERVAL seconds"""
+        import asyncio
+        while True:
+            await asyncio.sleep(LEARNER_SAVE_INTERVAL)
+            await self.save_learners()
+
+    async def handle(self, reader, writer):
+        """Serve the requests on one connection"""
+        import asyncio
+        try:
+            while True:
+                try:
+                    request = await read_request(reader)
+                except ValueError as ex:
+                    write_response(writer, 400,
+                                   {'error': "Bad request: {}".format(ex)},
+                                   False)
+                    await writer.drain()
+                    break
+                if request is None:
+                    break
+                method, target, body, keep_alive = request
+                try:
+                    status, reply = await self.route(method, target, body)
+                except (ValueError, KeyError, TypeError) as ex:
+                    status, reply = 400, {'error': str(ex)}
+                write_response(writer, status, reply, keep_alive)
+                await writer.drain()
+                if not keep_alive:
+                    break
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            writer.close()
+
+    async def route(self, method, target, body):
+        """Do a request, returning its status and JSON reply"""
+        import asyncio
+        url = urlsplit(target)
+        query = {name: values[0] for name, values in
+                 parse_qs(url.query).items()}
+        if method == 'GET' and url.path == '/next':
+            card = self.learner(query.get('learner')).next_card()
+            if card is None:
+                return 200, {'card': None}
+            cat, key = card
+            return 200, {'card': {'category': cat,
+                                  'key': json_key(key),
+                                  'prompt': card_prompt(cat, key)}}
+        if method == 'GET' and url.path == '/phrases':
+            found = get_deck().search_phrases(query.get('q', ''),
+                                              int(query.get('limit', 10)))
+            phrases = get_deck().content('phrase')
+            return 200, {'phrases': [
+                    {'key': json_key(key),
+                     'finnish': phrases.loc[key, 'Finnish'],
+                     'english': phrases.loc[key, 'English']} for
+                    key, _ in found]}
+        if method == 'POST' and url.path == '/answer':
+            request = json.loads(body)
+            learner = self.learner(request['learner'])
+            cat = request['category']
+            key = request['key']
+            if cat == 'phrase':
+                key = int(key)
+            answer = request['answer']
+            if not isinstance(answer, str):
+                raise ValueError("Bad answer: {!r}".format(answer))
+            expected = card_answer(cat, key)
+            correct = answer.strip().lower() == expected
+            next_review = learner.answer(cat, key, correct)
+            return 200, {'correct': correct, 'expected': expected,
+                         'next_review': str(next_review)}
+        if method == 'POST' and url.path == '/words':
+            request = json.loads(body)
+            cat = request['category']
+            if cat not in DATA_FILES:
+                raise ValueError("Bad category: {}".format(cat))
+            forms = request.get('forms')
+            if cat in FORM_COLUMNS and forms is None:
+                forms = await asyncio.get_running_loop().run_in_executor(
+                        None, lookup_forms, request['finnish'], cat)
+            key = add_card(cat, request['finnish'], request['english'],
+                           forms or None)
+            if key is None:
+                return 409, {'error': "Not added: {}".format(
+                        request['finnish'])}
+            # Writing the data file takes a while, so it is left to a thread
+            # to keep the other learners' requests going
+            await asyncio.get_running_loop().run_in_executor(
+                    None, flush_deck, cat)
+            return 201, {'key': json_key(key)}
+        return 404, {'error': "No such endpoint: {} {}".format(method,
+                                                                url.path)}
+
+def json_key(key):
+    """A card's key as a JSON value"""
+    return int(key) if isinstance(key, (int, np.integer)) else key
+
+async def read_request(reader):
+    """Read an HTTP request, returning its method, target, body and whether
+    the connection stays open, or None at the end of the connection
+
+    Raises ValueError for a malformed request"""
+    line = await reader.readline()
+    if not line.strip():
+        return None
+    parts = line.decode('latin-1').split()
+    if len(parts) != 3:
+        raise ValueError("Malformed request line")
+    method, target, version = parts
+    headers = {}
+    while True:
+        line = await reader.readline()
+        if not line.strip():
+            break
+        name, _, value = line.decode('latin-1').partition(':')
+        headers[name.strip().lower()] = value.strip().lower()
+    body = await reader.readexactly(int(headers.get('content-length', 0)))
+    if version == 'HTTP/1.0':
+        keep_alive = headers.get('connection') == 'keep-alive'
+    else:
+        keep_alive = headers.get('connection') != 'close'
+    return method, target, body, keep_alive
+
+def write_response(writer, status, reply, keep_alive):
+    """Write an HTTP response with a JSON body"""
+    reasons = {200: 'OK', 201: 'Created', 400: 'Bad Request',
+               404: 'Not Found', 409: 'Conflict'}
+    body = json.dumps(reply).encode('utf-8')
+    writer.write("HTTP/1.1 {} {}\r\n"
+                 "Content-Type: application/json\r\n"
+                 "Content-Length: {}\r\n"
+                 "Connection: {}\r\n\r\n".format(
+                         status, reasons[status], len(body),
+                         'keep-alive' if keep_alive else 'close')
+                 .encode('latin-1') + body)
+
+def serve_reviews(host=None, port=None):
+    """Run the review service until interrupted"""
+    import asyncio
+    async def serve():
+        service = ReviewService(host, port)
+        await service.start()
+        try:
+            await service.server.serve_forever()
+        finally:
+            await service.close()
+    try:
+        asyncio.run(serve())
+    except KeyboardInterrupt:
+        print("Stopped")
+
+async def load_test(learners=4, answers=1000, host=None, port=None,
+                    accuracy=0.8):
+    """Drill the review service from local clients and measure throughput
+
+    Each learner gets its own connection and alternates between asking for
+    its next card and answering it, correctly with the given probability.
+    Without a port, a service is started in this process on a free port,
+    keeping the load test's learners in a temporary directory. A service
+    on a port keeps them with its other learners. Returns the answers made,
+    the seconds taken and the answers per second."""
+    import asyncio
+    import shutil
+    service = None
+    if port is None:
+        learners_dir = tempfile.mkdtemp(prefix='finncards-load-test-')
+        service = ReviewService(host, 0, learners_dir)
+        await service.start()
+        port = service.port
+    host = SERVICE_HOST if host is None else host
+    async def call(reader, writer, method, target, request=None):
+        body = b"" if request is None else json.dumps(request).encode(
+                'utf-8')
+        writer.write("{} {} HTTP/1.1\r\nHost: {}\r\n"
+                     "Content-Length: {}\r\n\r\n".format(
+                             method, target, host, len(body))
+                     .encode('latin-1') + body)
+        await writer.drain()
+        headers = {}
+        await reader.readline()
+        while True:
+            line = await reader.readline()
+            if not line.strip():
+                break
+            name, _, value = line.decode('latin-1').partition(':')
+            headers[name.strip().lower()] = value.strip()
+        return json.loads(await reader.readexactly(
+                int(headers['content-length'])))
+    async def drill(name, count):
+        reader, writer = await asyncio.open_connection(host, port)
+        made = 0
+        for _ in range(count):
+            card = (await call(reader, writer, 'GET',
+                               '/next?learner={}'.format(name)))['card']
+            if card is None:
+                break
+            answer = card['key'] if card['category'] != 'phrase' else ""
+            if random.random() >= accuracy:
+                answer = ""
+            await call(reader, writer, 'POST', '/answer',
+                       {'learner': name, 'category': card['category'],
+                        'key': card['key'], 'answer': str(answer)})
+            made += 1
+        writer.close()
+        return made
+    loop = asyncio.get_running_loop()
+    start = loop.time()
+    made = await asyncio.gather(*[
+            drill("load-test-{}".format(i), answers // learners) for
+            i in range(learners)])
+    seconds = loop.time() - start
+    if service is not None:
+        await service.close()
+        shutil.rmtree(learners_dir, ignore_errors=True)
+    result = {'answers': sum(made), 'seconds': seconds,
+              'answers_per_second': sum(made) / seconds}
+    print("{answers} answers in {seconds:.2f}s, "
+          "{answers_per_second:.0f} per second".format(**result))
+    return result
+
+def import_time():
+    """Import this module in a fresh interpreter and time it
+
+    Returns the seconds taken and the scraping modules it loaded"""
+    script = ("import sys, time\n"
+              "start = time.perf_counter()\n"
+              "import finncards\n"
+              "print(time.perf_counter() - start)\n"
+              "print(','.join(m for m in {} if m in sys.modules))"
+              .format(SCRAPING_MODULES))
+    output = subprocess.run([sys.executable, '-c', script],
+                            cwd=os.path.dirname(os.path.abspath(__file__)),
+                            stdout=subprocess.PIPE,
+                            universal_newlines=True,
+                            check=True).stdout.splitlines()
+    loaded = output[1].split(',') if len(output) > 1 and output[1] else []
+    return float(output[0]), loaded
+
+def check_import_time(budget=None):
+    """Check that importing this module is fast and skips the scraping stack"""
+    if budget is None:
+        budget = IMPORT_TIME_BUDGET
+    seconds, loaded = import_time()
+    print("Import took {:.3f}s (budget {}s)".format(seconds, budget))
+    if loaded:
+        print("Scraping modules imported: {}".format(", ".join(loaded)))
+    return seconds <= budget and not loaded
+
+if __name__ == '__main__':
+    # Quiz straight from the command line: finncards.py [words|phrases]
+    # Or run the review service: finncards.py serve
+    # Or load test a service started for it: finncards.py loadtest
+    # Or show the cards due over the next weeks: finncards.py forecast
+    # Or back up or restore the data files: finncards.py backup|backups
+    # finncards.py restore [snapshot]
+    if len(sys.argv) > 1 and sys.argv[1] == 'phrases':
+        phrasecards()
+    elif len(sys.argv) > 1 and sys.argv[1] == 'backup':
+        backup_files()
+    elif len(sys.argv) > 1 and sys.argv[1] == 'backups':
+        print("\n".join(backup_snapshots()))
+    elif len(sys.argv) > 1 and sys.argv[1] == 'restore':
+        restore_backup(sys.argv[2] if len(sys.argv) > 2 else None)
+    elif len(sys.argv) > 1 and sys.argv[1] == 'forecast':
+        print(due_forecast().to_string())
+    elif len(sys.argv) > 1 and sys.argv[1] == 'serve':
+        serve_reviews()
+    elif len(sys.argv) > 1 and sys.argv[1] == 'loadtest':
+        import asyncio
+        asyncio.run(load_test())
+    else:
+        flashcards()
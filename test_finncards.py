@@ -0,0 +1,543 @@
+import asyncio
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import json
+import os
+import threading
+from types import SimpleNamespace
+from urllib.parse import unquote
+from xml.sax.saxutils import escape
+
+import pandas as pd
+import pytest
+
+import benchmark
+import finncards
+
+
+def test_import_skips_scraping_modules():
+    seconds, loaded = finncards.import_time()
+    assert loaded == []
+
+
+@pytest.mark.skipif(not os.environ.get('FINNCARDS_TIMING'),
+                    reason="timing test, set FINNCARDS_TIMING to run it")
+def test_import_time_within_budget():
+    # The best of a few runs, so one slow start doesn't fail the test
+    seconds = min(finncards.import_time()[0] for _ in range(3))
+    assert seconds <= finncards.IMPORT_TIME_BUDGET
+
+
+
+@pytest.fixture
+def deck_dir(tmp_path, monkeypatch):
+    """A small synthetic deck in a directory of its own"""
+    monkeypatch.chdir(tmp_path)
+    finncards.current_deck = None
+    benchmark.write_deck(benchmark.synthetic_deck(200, seed=1))
+    yield tmp_path
+    finncards.current_deck = None
+
+
+def test_in_file_english_matches_whole_cell(deck_dir):
+    invariants = finncards.load_invariants()
+    key = invariants.index[0]
+    english = invariants.loc[key, 'English']
+    invariants.loc['testisana'] = invariants.loc[key]
+    invariants.loc['testisana', 'English'] = 'light, bright'
+    finncards.save_rows(invariants, ['testisana'], 'invariant', new=True)
+    assert finncards.in_file(english, category='invariant', english=True)
+    assert finncards.in_file('light, bright', category='invariant',
+                             english=True)
+    assert not finncards.in_file('light', category='invariant', english=True)
+    assert ('invariant', 'testisana') in finncards.cards_with_english('light')
+
+
+def test_load_balance_spreads_short_intervals(deck_dir, monkeypatch):
+    monkeypatch.setattr(finncards, 'LOAD_BALANCE', True)
+    verbs = finncards.load_stats('verb')
+    keys = verbs.index[:60]
+    verbs.loc[keys, 'Interval'] = pd.to_timedelta('3 days')
+    verbs.loc[keys, 'Correct?'] = True
+    for key in keys:
+        finncards.process_correct(key, verbs, 'verb')
+    days = pd.to_datetime(verbs.loc[keys, 'Next review']).dt.normalize()
+    assert days.nunique() > 1
+    # Only the reviews move, so the moves don't compound over reviews
+    assert (verbs.loc[keys, 'Interval'] ==
+            pd.to_timedelta('3 days') * finncards.CORRECT_INTERVAL).all()
+
+
+def test_load_balanced_reviews_survive_the_journal(deck_dir, monkeypatch):
+    monkeypatch.setattr(finncards, 'LOAD_BALANCE', True)
+    monkeypatch.setattr(finncards, 'USE_JOURNAL', True)
+    verbs = finncards.load_stats('verb')
+    keys = verbs.index[:30]
+    verbs.loc[keys, 'Interval'] = pd.to_timedelta('10 days')
+    for key in keys:
+        finncards.process_correct(key, verbs, 'verb')
+    expected = pd.to_datetime(verbs.loc[keys, 'Next review'])
+    finncards.current_deck = None
+    reloaded = pd.to_datetime(finncards.load_stats('verb').loc[keys,
+                                                               'Next review'])
+    assert (reloaded == expected).all()
+
+
+def test_due_histogram_follows_answers_without_load_balance(deck_dir):
+    verbs = finncards.load_stats('verb')
+    histogram = finncards.get_deck().due_histogram('verb')
+    for key in verbs.index[:20]:
+        finncards.process_correct(key, verbs, 'verb')
+    rebuilt = finncards.DueHistogram(verbs['Next review'])
+    counts = histogram.window(rebuilt.origin,
+                              rebuilt.origin + len(rebuilt.counts) - 1)
+    assert (counts == rebuilt.counts).all()
+
+
+def test_due_histogram_follows_batch_reviews(deck_dir):
+    verbs = finncards.load_stats('verb')
+    histogram = finncards.get_deck().due_histogram('verb')
+    keys = verbs.index[:50]
+    now = pd.Timestamp.now()
+    finncards.process_reviews(keys, [True] * len(keys), [now] * len(keys),
+                              verbs, 'verb', save=False)
+    rebuilt = finncards.DueHistogram(verbs['Next review'])
+    counts = histogram.window(rebuilt.origin,
+                              rebuilt.origin + len(rebuilt.counts) - 1)
+    assert (counts == rebuilt.counts).all()
+
+
+def test_restore_drops_newer_journal(deck_dir, monkeypatch):
+    snapshot = finncards.backup_files()
+    verbs = finncards.load_stats('verb')
+    key = verbs.index[0]
+    times_correct = verbs.loc[key, 'Times correct']
+    monkeypatch.setattr(finncards, 'USE_JOURNAL', True)
+    finncards.process_correct(key, verbs, 'verb')
+    assert (deck_dir / finncards.JOURNAL_FILE).exists()
+    assert finncards.restore_backup(snapshot)
+    assert not (deck_dir / finncards.JOURNAL_FILE).exists()
+    finncards.current_deck = None
+    assert finncards.load_stats('verb').loc[key, 'Times correct'] == \
+        times_correct
+    # The state before the restore was backed up and can be restored
+    assert len(finncards.backup_snapshots()) == 2
+
+
+def test_generate_words_list_limits_and_sorts_merged_list(deck_dir):
+    everything = finncards.generate_words_list(load_all=False)
+    words, invariants, nominals, verbs = finncards.generate_words_list(
+            sort=True, limit=10)
+    assert len(everything) > 10
+    assert len(words) == 10
+    tables = {'invariant': invariants, 'nominal': nominals, 'verb': verbs}
+    next_reviews = [pd.Timestamp(tables[cat].loc[key, 'Next review']) for
+                    key, cat in everything]
+    cutoff = sorted(next_reviews)[9]
+    chosen = [pd.Timestamp(tables[cat].loc[key, 'Next review']) for
+              key, cat in words]
+    assert chosen == sorted(chosen)
+    assert max(chosen) == cutoff
+
+
+def test_journal_survives_reload_and_compaction(deck_dir, monkeypatch):
+    monkeypatch.setattr(finncards, 'USE_JOURNAL', True)
+    verbs = finncards.load_stats('verb')
+    keys = list(verbs.index[:6])
+    for key in keys[:4]:
+        finncards.process_correct(key, verbs, 'verb')
+    for key in keys[4:]:
+        finncards.process_incorrect(key, verbs, 'verb')
+    expected = verbs.loc[keys, finncards.STATS].copy()
+    assert len(finncards.load_journal()) == len(keys)
+    finncards.current_deck = None
+    reloaded = finncards.load_stats('verb').loc[keys, finncards.STATS]
+    pd.testing.assert_frame_equal(reloaded, expected, check_dtype=False)
+    assert finncards.compact_journal()
+    assert not (deck_dir / finncards.JOURNAL_FILE).exists()
+    finncards.current_deck = None
+    compacted = finncards.load_stats('verb').loc[keys, finncards.STATS]
+    pd.testing.assert_frame_equal(compacted, expected, check_dtype=False)
+
+
+def test_batch_reviews_match_one_by_one_replay(deck_dir, monkeypatch):
+    verbs = finncards.load_stats('verb')
+    replayed = verbs.copy()
+    start = pd.Timestamp.now().floor('s')
+    keys = list(verbs.index[:5]) * 3
+    correct = [True, False, True, True, False] * 2 + [True] * 5
+    timestamps = [start + pd.Timedelta(minutes=i) for i in range(len(keys))]
+    finncards.process_reviews(keys, correct, timestamps, verbs, 'verb',
+                              save=False)
+
+    # process_correct and process_incorrect take the time from the clock
+    clock = [None]
+    monkeypatch.setattr(finncards, 'datetime', SimpleNamespace(
+            datetime=SimpleNamespace(now=lambda: clock[0])))
+    monkeypatch.setattr(finncards, 'save_review', lambda *args, **kw: None)
+    for key, right, timestamp in zip(keys, correct, timestamps):
+        clock[0] = timestamp
+        if right:
+            finncards.process_correct(key, replayed, 'verb')
+        else:
+            finncards.process_incorrect(key, replayed, 'verb')
+    pd.testing.assert_frame_equal(verbs.loc[keys[:5], finncards.STATS],
+                                  replayed.loc[keys[:5], finncards.STATS],
+                                  check_dtype=False)
+
+
+def to_microseconds(words_df):
+    """The dates of a table to the microsecond, as kept by the database"""
+    words_df = words_df.copy()
+    for column in ['Last reviewed', 'Next review']:
+        words_df[column] = pd.to_datetime(words_df[column]).dt.floor('us')
+    return words_df
+
+
+@pytest.mark.parametrize('fmt', ['feather', 'parquet', 'sqlite'])
+def test_migrate_storage_round_trip(deck_dir, monkeypatch, fmt):
+    before = {cat: to_microseconds(finncards.read_data(cat, fmt='csv')) for
+              cat in finncards.DATA_FILES}
+    assert finncards.migrate_storage(fmt)
+    monkeypatch.setattr(finncards, 'STORAGE_FORMAT', fmt)
+    finncards.current_deck = None
+    for cat, words_df in before.items():
+        migrated = to_microseconds(finncards.read_data(cat))
+        pd.testing.assert_frame_equal(migrated, words_df, check_dtype=False)
+    # And back again
+    for cat in finncards.DATA_FILES:
+        (deck_dir / finncards.data_path(cat, 'csv')).unlink()
+    assert finncards.migrate_storage('csv', from_format=fmt)
+    for cat, words_df in before.items():
+        restored = to_microseconds(finncards.read_data(cat, fmt='csv'))
+        pd.testing.assert_frame_equal(restored, words_df, check_dtype=False)
+
+
+def test_unknown_storage_format_is_an_error(deck_dir):
+    with pytest.raises(ValueError):
+        finncards.read_table('verb', fmt='xlsx')
+    with pytest.raises(ValueError):
+        finncards.write_table(finncards.read_table('verb'), 'verb',
+                              fmt='xlsx')
+
+
+def test_offline_lookup_uses_cached_page(deck_dir, monkeypatch):
+    forms = ["talo{}".format(i) for i in range(len(finncards.NOMINAL_FORMS))]
+    cache = {}
+    finncards.cache_page(cache, 'talo', 1,
+                         benchmark.fixture_page('nominal', 'talo', forms))
+    finncards.save_cache_index(cache)
+    monkeypatch.setattr(finncards, 'CACHE_OFFLINE', True)
+
+    def no_network(word):
+        raise AssertionError("fetched {}".format(word))
+
+    assert finncards.lookup_forms('talo', 'nominal', fetch=no_network) == \
+        forms
+    assert finncards.lookup_forms('auto', 'nominal', fetch=no_network) is None
+    # The extracted forms were saved with the page
+    entry = finncards.load_cache_index()['talo']
+    assert entry['forms']['nominal'] == forms
+
+
+@pytest.fixture
+def wiktionary(monkeypatch):
+    """A local stand-in for Wiktionary serving the pages put in it"""
+    pages = {}
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            page = pages.get(unquote(self.path.rsplit('/', 1)[-1]))
+            self.send_response(200 if page is not None else 404)
+            self.send_header('Content-Type', 'text/html; charset=utf-8')
+            self.end_headers()
+            self.wfile.write((page or "Not found").encode('utf-8'))
+
+        def log_message(self, *args):
+            pass
+
+    server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    monkeypatch.setattr(finncards, 'WIKTIONARY_URL',
+                        "http://127.0.0.1:{}/wiki/{{}}".format(
+                                server.server_address[1]))
+    yield pages
+    server.shutdown()
+    server.server_close()
+
+
+def test_import_words_fetches_from_local_wiktionary(deck_dir, monkeypatch,
+                                                    wiktionary):
+    pytest.importorskip('requests_html')
+    monkeypatch.setattr(finncards, 'IMPORT_RATE', 100)
+    monkeypatch.setattr(finncards, 'IMPORT_BACKOFF', 0)
+    nominal = ["testitalo{}".format(i) for i in
+               range(len(finncards.NOMINAL_FORMS))]
+    verb = ["testaan{}".format(i) for i in range(len(finncards.VERB_FORMS))]
+    wiktionary['testitalo'] = benchmark.fixture_page('nominal', 'testitalo',
+                                                     nominal)
+    wiktionary['testata'] = benchmark.fixture_page('verb', 'testata', verb)
+    (deck_dir / 'import.csv').write_text(
+            "Finnish,Category,English\n"
+            "testitalo,nominal,test house\n"
+            "testata,verb,test;tests;tested;tested\n"
+            "testipuuttuu,nominal,missing\n", encoding='utf-8')
+    assert finncards.import_words('import.csv') == ['testipuuttuu']
+    finncards.flush_deck()
+    finncards.current_deck = None
+    nominals = finncards.load_nominals()
+    assert list(nominals.loc['testitalo',
+                             list(finncards.NOMINAL_FORMS)]) == nominal
+    verbs = finncards.load_verbs()
+    assert list(verbs.loc['testata', list(finncards.VERB_FORMS)]) == verb
+    assert set(finncards.load_cache_index()) == {'testitalo', 'testata'}
+
+
+def test_ingest_dump_skips_wikitext_pages(tmp_path, capsys):
+    forms = ["kirja{}".format(i) for i in range(len(finncards.NOMINAL_FORMS))]
+    rendered = escape(benchmark.fixture_page('nominal', 'kirja', forms))
+    wikitext = ("==Finnish==\n===Noun===\n{{fi-noun}}\n\n"
+                "====Declension====\n{{fi-decl-valo|ta|l|o|||a}}")
+    (tmp_path / 'dump.xml').write_text(
+            "<mediawiki><page><title>kirja</title><revision><text>{}</text>"
+            "</revision></page><page><title>talo</title><revision><text>{}"
+            "</text></revision></page></mediawiki>".format(rendered,
+                                                           wikitext),
+            encoding='utf-8')
+    tables = finncards.ingest_dump(str(tmp_path / 'dump.xml'), processes=1)
+    assert list(tables['nominal'].index) == ['kirja']
+    assert list(tables['nominal'].loc['kirja']) == forms
+    assert tables['verb'].empty
+    assert "Skipped 1 pages of wikitext" in capsys.readouterr().out
+
+
+def test_phrase_search_ranks_exact_then_typo_matches():
+    index = finncards.PhraseIndex()
+    index.add(0, "hyvää huomenta", "good morning")
+    index.add(1, "hyvää yötä", "good night")
+    index.add(2, "kiitos paljon", "thank you very much")
+    assert [phrase_i for phrase_i, _ in index.search("morning")] == [0]
+    # A typo still finds the phrase
+    assert [phrase_i for phrase_i, _ in index.search("huomneta")] == [0]
+    assert [phrase_i for phrase_i, _ in index.search("good")][:2] == [0, 1]
+    assert index.search("good", limit=1) == index.search("good")[:1]
+    index.add(0, "hyvää päivää", "good day")
+    assert index.search("morning") == []
+    index.remove(1)
+    assert [phrase_i for phrase_i, _ in index.search("good")] == [0]
+
+
+def test_form_table_round_trips_wide_forms(deck_dir):
+    columns = finncards.FORM_COLUMNS['verb']
+    verbs = finncards.read_table('verb')
+    wide = verbs[columns].replace("", float('nan'))
+    table = finncards.FormTable.from_wide(verbs, columns)
+    pd.testing.assert_frame_equal(table.wide(), wide, check_names=False)
+    word = verbs.index[3]
+    assert table.form(word, columns[5]) == verbs.loc[word, columns[5]]
+    assert list(table.word_forms(word)) == list(wide.loc[word].dropna())
+    # Updating a word replaces its forms, leaving a gap for an empty one
+    changed = verbs.loc[[word], columns].copy()
+    changed[columns[0]] = "en muista"
+    changed[columns[1]] = ""
+    table.update(changed)
+    assert table.form(word, columns[0]) == "en muista"
+    assert pd.isnull(table.form(word, columns[1]))
+    assert table.form(verbs.index[4], columns[0]) == \
+        verbs.loc[verbs.index[4], columns[0]]
+
+
+def test_form_stats_merges_new_pairs_in_order():
+    forms = finncards.FORM_COLUMNS['verb']
+    stats = finncards.FormStats(forms)
+    start = pd.Timestamp('2026-01-01')
+    stats.review('olla', forms[2], True, now=start)
+    stats.review('tehdä', forms[0], False, now=start)
+    stats.review('olla', forms[0], True, now=start)
+    # Answers for a pair still waiting to be merged apply to its stats
+    stats.review('olla', forms[0], True, now=start + pd.Timedelta('1 day'))
+    assert len(stats.pending) == 3
+    assert list(stats.seen('olla')) == [forms[0], forms[2]]
+    assert not stats.pending
+    rows = stats.to_frame('verb')
+    assert list(rows['Word']) == ['olla', 'olla', 'tehdä']
+    assert list(rows['Times correct']) == [2, 1, 0]
+    assert list(rows['Times incorrect']) == [0, 0, 1]
+    loaded = finncards.FormStats.from_frame(rows, forms)
+    pd.testing.assert_frame_equal(loaded.to_frame('verb'), rows)
+    # A pair is due only once its next review has passed, as with cards
+    next_review = rows['Next review'].iloc[1]
+    assert stats.due(now=next_review, words=['olla']).empty
+    due = stats.due(now=next_review + pd.Timedelta('1s'), words=['olla'])
+    assert list(due['Form']) == [forms[2]]
+
+
+def test_load_test_drills_an_in_process_service(deck_dir):
+    result = asyncio.run(finncards.load_test(learners=2, answers=40))
+    assert result['answers'] == 40
+    # The load test's learners don't join the real ones
+    assert not (deck_dir / finncards.LEARNERS_DIR).exists()
+
+
+def test_review_service_rejects_bad_answers(deck_dir):
+    service = finncards.ReviewService(learners_dir=str(deck_dir / 'learners'))
+    key = finncards.get_deck().stats('verb').index[0]
+
+    async def answer(value):
+        return await service.route('POST', '/answer', json.dumps(
+                {'learner': 'testi', 'category': 'verb', 'key': key,
+                 'answer': value}))
+
+    assert asyncio.run(answer(key))[1]['correct']
+    with pytest.raises(ValueError):
+        asyncio.run(answer(None))
+
+
+def test_learner_covers_changed_cards_of_the_same_count(deck_dir):
+    learner = finncards.Learner('testi', str(deck_dir / 'learners'))
+    stats = learner.stats('invariant')
+    deck_stats = finncards.get_deck().stats('invariant')
+    # Swap a card for another, leaving the number of cards the same
+    old_key = deck_stats.index[0]
+    deck_stats.loc['uusisana'] = deck_stats.loc[old_key]
+    deck_stats.drop(index=old_key, inplace=True)
+    assert len(stats) == len(deck_stats)
+    assert 'uusisana' in learner.stats('invariant').index
+    assert old_key not in learner.stats('invariant').index
+
+
+def test_split_stats_writes_only_the_stats_file(deck_dir, monkeypatch):
+    assert finncards.split_storage()
+    monkeypatch.setattr(finncards, 'SPLIT_STATS', True)
+    finncards.current_deck = None
+    content = deck_dir / finncards.data_path('verb', part='content')
+    content_bytes = content.read_bytes()
+    verbs = finncards.load_stats('verb')
+    assert list(verbs.columns) == finncards.STATS
+    key = verbs.index[0]
+    finncards.process_correct(key, verbs, 'verb')
+    expected = verbs.loc[key].copy()
+    finncards.flush_deck()
+    assert content.read_bytes() == content_bytes
+    finncards.current_deck = None
+    pd.testing.assert_series_equal(finncards.load_stats('verb').loc[key],
+                                   expected, check_dtype=False)
+    # The content still joins up with the stats
+    assert finncards.read_data('verb').loc[key, 'Times correct'] == \
+        expected['Times correct']
+
+
+def test_simulator_follows_the_interval_rules():
+    always = finncards.simulate_reviews(10, days=15, recall=1.0,
+                                        correct_interval=2)
+    assert list(always.index[always['Reviews'] > 0]) == [0, 2, 6, 14]
+    assert (always.loc[always['Reviews'] > 0, 'Reviews'] == 10).all()
+    assert always['Retries'].sum() == 0
+    # Missed cards stay due and are retried up to max_retries times a day
+    never = finncards.simulate_reviews(10, days=3, recall=0.0,
+                                       max_retries=2)
+    assert list(never['Reviews']) == [10, 10, 10]
+    assert list(never['Retries']) == [20, 20, 20]
+    assert list(never['Retention']) == [0, 0, 0]
+    # A seed makes a run repeatable
+    pd.testing.assert_frame_equal(
+            finncards.simulate_reviews(50, days=30, trials=3, seed=7,
+                                       recall=finncards.forgetting_curve()),
+            finncards.simulate_reviews(50, days=30, trials=3, seed=7,
+                                       recall=finncards.forgetting_curve()))
+
+
+def test_session_queue_orders_and_requeues_cards():
+    cards = [('e', 'invariant', 5), ('c', 'nominal', 3), ('a', 'invariant', 1),
+             ('d', 'verb', 4), ('b', 'invariant', 2)]
+
+    def drain(queue, miss=()):
+        shown = []
+        while queue:
+            key, cat = queue.pop()
+            shown.append(key)
+            if key in miss and shown.count(key) == 1:
+                queue.requeue(key, cat, gap=3)
+        return shown
+
+    assert drain(finncards.SessionQueue(cards)) == ['a', 'b', 'c', 'd', 'e']
+    # A missed card comes back after three others, or last
+    assert drain(finncards.SessionQueue(cards), miss='a') == \
+        ['a', 'b', 'c', 'd', 'a', 'e']
+    assert drain(finncards.SessionQueue(cards), miss='d') == \
+        ['a', 'b', 'c', 'd', 'e', 'd']
+    # Interleaved, the categories take turns
+    assert drain(finncards.SessionQueue(cards, interleave=True)) == \
+        ['a', 'c', 'd', 'b', 'e']
+
+
+@pytest.mark.parametrize('split', [False, True])
+def test_flush_brings_last_written_copy_up_to_date(deck_dir, monkeypatch,
+                                                   split):
+    if split:
+        finncards.split_storage()
+        monkeypatch.setattr(finncards, 'SPLIT_STATS', True)
+        finncards.current_deck = None
+    deck = finncards.get_deck()
+    verbs = finncards.load_verbs()
+    for key in verbs.index[:3]:
+        finncards.process_correct(key, verbs, 'verb')
+    finncards.flush_deck()
+    assert 'verb' in deck.written
+    for key in verbs.index[2:6]:
+        finncards.process_incorrect(key, verbs, 'verb')
+    verbs = finncards.load_verbs()
+    verbs.loc[verbs.index[7], 'English present'] = 'test'
+    finncards.save_rows(verbs, [verbs.index[7]], 'verb',
+                        columns=['English present'])
+    verbs.loc['testata'] = verbs.loc[verbs.index[8]]
+    finncards.save_rows(verbs, ['testata'], 'verb', new=True)
+    finncards.flush_deck()
+    expected = deck.full_table('verb')
+    pd.testing.assert_frame_equal(finncards.read_data('verb'), expected,
+                                  check_dtype=False)
+
+
+def test_background_writer_writes_and_stops(deck_dir, monkeypatch):
+    monkeypatch.setattr(finncards, 'BACKGROUND_WRITES', True)
+    monkeypatch.setattr(finncards, 'WRITE_DELAY', 60)
+    monkeypatch.setattr(finncards, 'WRITE_WINDOW', 3)
+    verbs = finncards.load_stats('verb')
+    writer = finncards.get_deck().writer
+    keys = verbs.index[:4]
+    # A full window is written without waiting out the delay
+    for key in keys[:3]:
+        finncards.process_correct(key, verbs, 'verb')
+    with writer.condition:
+        assert writer.condition.wait_for(lambda: writer.pending == 0, 10)
+    on_disk = finncards.read_table('verb')
+    assert (on_disk.loc[keys[:3], 'Times correct'] ==
+            verbs.loc[keys[:3], 'Times correct']).all()
+    # What is left is written on stopping
+    finncards.process_correct(keys[3], verbs, 'verb')
+    finncards.flush_deck()
+    assert not writer.thread.is_alive()
+    assert finncards.read_table('verb').loc[keys[3], 'Times correct'] == \
+        verbs.loc[keys[3], 'Times correct']
+
+
+def test_restore_across_a_storage_format_change(deck_dir, monkeypatch):
+    snapshot = finncards.backup_files()
+    assert finncards.load_manifest(snapshot)['storage_format'] == 'csv'
+    csv_bytes = (deck_dir / 'verbs.csv').read_bytes()
+    assert finncards.migrate_storage('feather')
+    monkeypatch.setattr(finncards, 'STORAGE_FORMAT', 'feather')
+    finncards.current_deck = None
+    verbs = finncards.load_stats('verb')
+    finncards.process_correct(verbs.index[0], verbs, 'verb')
+    finncards.flush_deck()
+    (deck_dir / 'verbs.csv').write_text("changed", encoding='utf-8')
+    feather = deck_dir / finncards.data_path('verb')
+    feather_bytes = feather.read_bytes()
+    assert finncards.restore_backup(snapshot)
+    # The snapshot's csv files are back and the live feather files are kept
+    assert (deck_dir / 'verbs.csv').read_bytes() == csv_bytes
+    assert feather.read_bytes() == feather_bytes
+    # Both formats were backed up before the restore
+    undo = finncards.load_manifest(finncards.backup_snapshots()[-1])
+    assert {'verbs.csv', finncards.data_path('verb')} <= set(undo['files'])